@@ -1,10 +1,11 @@
-import bcrypt
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-import database, models
+import database, models, schemas
+from user_cache import user_cache
+from password_hashing import hash_password_sync, check_password_sync
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY", "miau_secret_key_123")
@@ -14,12 +15,13 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
+# Blocking variants, for scripts and startup. Request handlers go through
+# password_hashing.password_hasher so bcrypt never runs on a request worker.
 def verify_password(plain_password: str, hashed_password: str):
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return check_password_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str):
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    return hash_password_sync(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -28,7 +30,26 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def fetch_user_identity(db: Session, email: str):
+    row = db.query(
+        models.User.id, models.User.email, models.User.is_admin, models.User.is_active
+    ).filter(models.User.email == email).first()
+    if row is None:
+        return None
+    return schemas.AuthenticatedUser(
+        id=row.id, email=row.email, is_admin=bool(row.is_admin), is_active=bool(row.is_active)
+    )
+
+async def load_user_identity(email: str, db: database.AsyncDB):
+    user = user_cache.get(email)
+    if user is None:
+        user = await db.run(fetch_user_identity, email)
+        if user is None:
+            return None
+        user_cache.set(email, user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: database.AsyncDB = Depends(database.get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -41,12 +62,12 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
+    user = await load_user_identity(email, db)
+    if user is None or not user.is_active:
         raise credentials_exception
     return user
 
-def get_optional_current_user(token: str = Depends(oauth2_scheme_optional), db: Session = Depends(database.get_db)):
+async def get_optional_current_user(token: str = Depends(oauth2_scheme_optional), db: database.AsyncDB = Depends(database.get_async_db)):
     if not token:
         return None
     try:
@@ -56,5 +77,7 @@ def get_optional_current_user(token: str = Depends(oauth2_scheme_optional), db:
             return None
     except JWTError:
         return None
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await load_user_identity(email, db)
+    if user is None or not user.is_active:
+        return None
     return user
@@ -0,0 +1,271 @@
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+os.environ.setdefault("PAYMENT_GATEWAY", "fake")
+
+import httpx
+
+# Load benchmark for the API's main flows. Each scenario runs on its own for
+# --duration seconds with --concurrency workers, and the results (p50/p95/p99
+# latency, throughput, status codes) are printed as JSON so two commits can be
+# compared with --compare. By default the app runs in-process against
+# DATABASE_URL (fill it with datagen.py first) and the fake payment gateway, so
+# no network is involved; --url points it at a running server instead:
+#   python bench_load.py --duration 20 --concurrency 16 --output after.json --compare before.json
+
+SCENARIOS = ("browse", "cart", "login", "checkout", "admin")
+SEARCH_TERMS = ("rascador", "cama", "fuente", "juguete", "arena", "hamaca", "felpa", "snack")
+BENCH_PASSWORD = "miau-bench-123"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def add(self, seconds: float, status):
+        self.latencies.append(seconds)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if not isinstance(status, int) or status >= 500:
+            self.errors += 1
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    # Nearest rank on an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    ordered = sorted(recorder.latencies)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "requests": len(ordered),
+        "errors": recorder.errors,
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(ordered, 0.50)),
+            "p95": ms(percentile(ordered, 0.95)),
+            "p99": ms(percentile(ordered, 0.99)),
+            "max": ms(ordered[-1]) if ordered else 0.0,
+            "mean": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        },
+        "status": recorder.statuses,
+    }
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, args):
+        self.client = client
+        self.rng = rng
+        self.args = args
+        self.product_ids = []
+        self.in_stock_ids = []
+        self.categories = []
+        self.users = []
+        self.tokens = []
+        self.admin_headers = {}
+
+    async def request(self, recorder: Recorder, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            recorder.add(time.perf_counter() - started, type(exc).__name__)
+            return None
+        recorder.add(time.perf_counter() - started, response.status_code)
+        return response
+
+    async def setup(self):
+        response = await self.client.get("/products", params={"fields": "id,stock"})
+        response.raise_for_status()
+        products = response.json()
+        self.product_ids = [p["id"] for p in products]
+        self.in_stock_ids = [p["id"] for p in products if p["stock"] > 0]
+        response = await self.client.get("/products/facets")
+        self.categories = [c["category"] for c in response.json()["categories"]]
+
+        # Accounts of our own, so the run never depends on who else is in the database
+        run_id = uuid.uuid4().hex[:8]
+        for n in range(self.args.users):
+            email = f"bench-{run_id}-{n}@bench.miauhome.test"
+            response = await self.client.post("/register", json={
+                "email": email, "password": BENCH_PASSWORD, "first_name": "Bench", "last_name": str(n)
+            })
+            response.raise_for_status()
+            self.users.append(email)
+            self.tokens.append(await self.login(email, BENCH_PASSWORD))
+        self.admin_headers = {"Authorization": f"Bearer {await self.login(self.args.admin_email, self.args.admin_password)}"}
+
+    async def login(self, email: str, password: str) -> str:
+        response = await self.client.post("/login", json={"email": email, "password": password})
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    async def browse(self, recorder: Recorder, state: dict):
+        roll = self.rng.random()
+        if roll < 0.35:
+            params = {"limit": 24, "fields": "card"}
+            if self.categories and self.rng.random() < 0.5:
+                params["category"] = self.rng.choice(self.categories)
+            if state.get("cursor") and self.rng.random() < 0.5:
+                params["after"] = state["cursor"]
+            response = await self.request(recorder, "GET", "/products", params=params)
+            state["cursor"] = response.headers.get("x-next-cursor") if response is not None else None
+        elif roll < 0.5:
+            await self.request(recorder, "GET", "/products/facets")
+        elif roll < 0.85:
+            await self.request(recorder, "GET", f"/products/{self.rng.choice(self.product_ids)}")
+        else:
+            await self.request(recorder, "GET", "/products/search", params={"q": self.rng.choice(SEARCH_TERMS), "fields": "card"})
+
+    async def cart(self, recorder: Recorder, state: dict):
+        headers = {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+        if self.rng.random() < 0.6:
+            await self.request(recorder, "POST", "/cart/items", headers=headers, json={
+                "product_id": self.rng.choice(self.product_ids), "quantity": 1
+            })
+        else:
+            await self.request(recorder, "GET", "/cart", headers=headers)
+
+    async def login_step(self, recorder: Recorder, state: dict):
+        await self.request(recorder, "POST", "/login", json={"email": self.rng.choice(self.users), "password": BENCH_PASSWORD})
+
+    async def checkout(self, recorder: Recorder, state: dict):
+        product_id = self.rng.choice(self.in_stock_ids or self.product_ids)
+        await self.request(recorder, "POST", "/checkout", headers={"Idempotency-Key": uuid.uuid4().hex}, json={
+            "guest_email": "bench@bench.miauhome.test",
+            "guest_address": "Av. Siempre Viva 742, Santiago",
+            "items": [{"product_id": product_id, "quantity": 1}],
+        })
+
+    async def admin(self, recorder: Recorder, state: dict):
+        roll = self.rng.random()
+        if roll < 0.5:
+            params = {"limit": 50}
+            if state.get("cursor") and self.rng.random() < 0.5:
+                params["after"] = state["cursor"]
+            response = await self.request(recorder, "GET", "/orders", headers=self.admin_headers, params=params)
+            state["cursor"] = response.headers.get("x-next-cursor") if response is not None else None
+        elif roll < 0.75:
+            await self.request(recorder, "GET", "/orders", headers=self.admin_headers,
+                               params={"limit": 50, "status": "paid", "fields": "summary"})
+        else:
+            await self.request(recorder, "GET", "/stats/summary", headers=self.admin_headers)
+
+    async def run(self, scenario: str) -> dict:
+        step = self.login_step if scenario == "login" else getattr(self, scenario)
+        recorder = Recorder()
+        deadline = time.perf_counter() + self.args.duration
+
+        async def worker():
+            state = {}
+            while time.perf_counter() < deadline:
+                await step(recorder, state)
+
+        if self.args.warmup:
+            warmup = Recorder()
+            warm_until = time.perf_counter() + self.args.warmup
+            while time.perf_counter() < warm_until:
+                await step(warmup, {})
+            deadline = time.perf_counter() + self.args.duration
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return summarize(recorder, time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline: dict, current: dict):
+    print(f"{'scenario':<10}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'req/s':>18}", file=sys.stderr)
+    for scenario, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            cells.append(change(before["latency_ms"][key], result["latency_ms"][key]))
+        cells.append(change(before["throughput_rps"], result["throughput_rps"]))
+        print(f"{scenario:<10}" + "".join(f"{cell:>18}" for cell in cells), file=sys.stderr)
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return f"{after}"
+    return f"{after} ({(after - before) / before * 100:+.0f}%)"
+
+
+async def run_benchmark(args):
+    rng = random.Random(args.seed)
+    results = {}
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30)
+        lifespan = None
+    else:
+        import main as api
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench", timeout=30)
+        lifespan = api.app.router.lifespan_context(api.app)
+        await lifespan.__aenter__()
+    try:
+        bench = Bench(client, rng, args)
+        await bench.setup()
+        for scenario in args.scenarios:
+            results[scenario] = await bench.run(scenario)
+            print(f"{scenario}: {results[scenario]['throughput_rps']} req/s, p95 {results[scenario]['latency_ms']['p95']} ms",
+                  file=sys.stderr)
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "target": args.url or f"in-process ({os.getenv('DATABASE_URL', 'default DATABASE_URL')})",
+        "config": {"duration": args.duration, "concurrency": args.concurrency, "warmup": args.warmup, "seed": args.seed},
+        "scenarios": results,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Latency percentiles and throughput for the main API flows")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=float, default=1, help="seconds of single-worker warmup per scenario")
+    parser.add_argument("--users", type=int, default=10, help="accounts registered for the cart and login scenarios")
+    parser.add_argument("--admin-email", default="admin@miauhome.cl")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    body = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body + "\n")
+    else:
+        print(body)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,118 @@
+import datetime
+import json
+import os
+import random
+import time
+from typing import List
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import compression
+import models
+import responses
+import schemas
+
+# Micro-benchmark for the /products and /orders response paths: bytes on the
+# wire and CPU per response for each serializer, then per content encoding.
+# Runs on transient ORM objects, so no database is needed:
+#   python bench_responses.py [--products 100] [--orders 200] [--repeat 200]
+
+
+WORDS = ("rascador", "cama", "fuente", "juguete", "arena", "gato", "suave", "acolchada", "niveles", "hamaca",
+         "premium", "silenciosa", "filtro", "natural", "resistente", "lavable", "compacta", "madera", "sisal", "felpa")
+
+
+def sample_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def sample_hash(rng: random.Random) -> str:
+    return "%032x" % rng.getrandbits(128)
+
+
+def sample_products(count: int, rng: random.Random):
+    return [
+        models.Product(
+            id=i, sku=f"MH-{i:05d}", name=sample_text(rng, 3), description=sample_text(rng, 25),
+            price=rng.randrange(1990, 99990, 10), image_url=f"https://cdn.example.com/images/{sample_hash(rng)}.jpg",
+            category=rng.choice(("Muebles", "Juguetes", "Higiene", "Descanso")), stock=rng.randrange(50), is_active=True,
+            variations=[
+                models.ProductVariation(
+                    id=i * 10 + v, product_id=i, name=sample_text(rng, 2), variation_type="color",
+                    price=rng.choice((None, rng.randrange(1990, 99990, 10))), stock=rng.randrange(20)
+                )
+                for v in range(3)
+            ],
+            images=[models.ProductImage(id=i * 10 + n, product_id=i, url=f"https://cdn.example.com/images/{sample_hash(rng)}.jpg") for n in range(2)],
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def sample_orders(count: int, rng: random.Random):
+    now = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    return [
+        models.Order(
+            id=i, total_amount=rng.randrange(1990, 299990, 10), status=rng.choice(("paid", "pending", "shipped", "failed")),
+            buy_order=sample_hash(rng)[:26], payment_type="webpay_plus",
+            created_at=now - datetime.timedelta(seconds=rng.randrange(86400 * 30)),
+            guest_email=f"cliente{rng.randrange(10**6)}@example.com", guest_address=f"{sample_text(rng, 2)} {rng.randrange(9999)}, Santiago"
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def cpu_per_call(fn, repeat: int) -> float:
+    fn()
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1e6
+
+
+def serializers(schema, rows):
+    adapter = TypeAdapter(List[schema])
+    return {
+        # Model instances through jsonable_encoder + json.dumps: what a plain
+        # JSONResponse (or any route without response_model) does
+        "stdlib": lambda: json.dumps(jsonable_encoder([schema.model_validate(row) for row in rows])).encode(),
+        # Handler validates, FastAPI validates the models again for
+        # response_model, then dumps with pydantic-core
+        "response_model": lambda: adapter.dump_json(adapter.validate_python([schema.model_validate(row) for row in rows])),
+        # One validation straight from the ORM rows, dumped by pydantic-core
+        "trusted": lambda: responses.trusted_json(adapter, rows).body,
+        # What FastAPI does for response_model with a custom response class:
+        # validate, dump to Python, then render with orjson
+        "response_class": lambda: responses.FastJSONResponse(
+            adapter.dump_python(adapter.validate_python([schema.model_validate(row) for row in rows]), mode="json")
+        ).body,
+    }
+
+
+def report(name: str, schema, rows, repeat: int):
+    print(f"\n{name}: {len(rows)} rows")
+    print(f"  {'serializer':<16}{'bytes':>10}{'cpu us':>10}")
+    body = b""
+    for label, fn in serializers(schema, rows).items():
+        body = fn()
+        print(f"  {label:<16}{len(body):>10}{cpu_per_call(fn, repeat):>10.0f}")
+    print(f"  {'encoding':<16}{'bytes':>10}{'cpu us':>10}")
+    for encoding in compression.available_encodings():
+        compressed = compression.compress(body, encoding)
+        print(f"  {encoding:<16}{len(compressed):>10}{cpu_per_call(lambda: compression.compress(body, encoding), repeat):>10.0f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bytes and CPU per response for /products and /orders")
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    report("/products", schemas.Product, sample_products(args.products, rng), args.repeat)
+    report("/orders", schemas.Order, sample_orders(args.orders, rng), args.repeat)
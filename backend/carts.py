@@ -0,0 +1,129 @@
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, joinedload
+
+import models
+from database import dialect_insert
+
+
+def cart_query(db: Session):
+    # Cart, lines, products (with variations and images) and line variations in one query
+    return db.query(models.Cart).options(
+        joinedload(models.Cart.items).joinedload(models.CartItem.product).joinedload(models.Product.variations),
+        joinedload(models.Cart.items).joinedload(models.CartItem.product).joinedload(models.Product.images),
+        joinedload(models.Cart.items).joinedload(models.CartItem.variation)
+    )
+
+
+def load_cart(db: Session, user_id: int):
+    return cart_query(db).filter(models.Cart.user_id == user_id).first()
+
+
+def ensure_cart_id(db: Session, user_id: int):
+    cart_id = db.query(models.Cart.id).filter(models.Cart.user_id == user_id).scalar()
+    if cart_id is not None:
+        return cart_id
+    stmt = dialect_insert(db, models.Cart.__table__)
+    if stmt is None:
+        cart = models.Cart(user_id=user_id)
+        db.add(cart)
+        db.flush()
+        return cart.id
+    db.execute(stmt.values(user_id=user_id).on_conflict_do_nothing(index_elements=["user_id"]))
+    return db.query(models.Cart.id).filter(models.Cart.user_id == user_id).scalar()
+
+
+def upsert_lines(db: Session, cart_id: int, lines: dict, replace: bool = False):
+    # lines maps (product_id, variation_id) -> quantity. The quantity is added
+    # to an existing line, or replaces it when replace is set. Concurrent adds
+    # of the same line just sum up.
+    if not lines:
+        return
+    stmt = dialect_insert(db, models.CartItem.__table__)
+    if stmt is None:
+        for (product_id, variation_id), quantity in lines.items():
+            cart_item = db.query(models.CartItem).filter(
+                models.CartItem.cart_id == cart_id,
+                models.CartItem.product_id == product_id,
+                models.CartItem.variation_id == variation_id
+            ).with_for_update().first()
+            if cart_item:
+                cart_item.quantity = quantity if replace else cart_item.quantity + quantity
+            else:
+                db.add(models.CartItem(
+                    cart_id=cart_id, product_id=product_id, variation_id=variation_id, quantity=quantity
+                ))
+        db.flush()
+        return
+
+    # Lines with and without a variation conflict on different partial indexes,
+    # so each group is one multi-row statement
+    for has_variation in (False, True):
+        rows = [
+            {"cart_id": cart_id, "product_id": product_id, "variation_id": variation_id, "quantity": quantity}
+            for (product_id, variation_id), quantity in lines.items()
+            if (variation_id is not None) == has_variation
+        ]
+        if not rows:
+            continue
+        if has_variation:
+            conflict = {
+                "index_elements": ["cart_id", "product_id", "variation_id"],
+                "index_where": models.CartItem.variation_id.isnot(None)
+            }
+        else:
+            conflict = {"index_elements": ["cart_id", "product_id"], "index_where": models.CartItem.variation_id.is_(None)}
+        insert = stmt.values(rows)
+        quantity = insert.excluded.quantity if replace else models.CartItem.__table__.c.quantity + insert.excluded.quantity
+        db.execute(insert.on_conflict_do_update(set_={"quantity": quantity}, **conflict))
+
+
+def add_item(db: Session, cart_id: int, product_id: int, variation_id, quantity: int):
+    upsert_lines(db, cart_id, {(product_id, variation_id): quantity})
+    bump_version(db, cart_id)
+
+
+def remove_lines(db: Session, cart_id: int, lines):
+    if not lines:
+        return 0
+    conditions = [
+        and_(
+            models.CartItem.product_id == product_id,
+            models.CartItem.variation_id.is_(None) if variation_id is None else models.CartItem.variation_id == variation_id
+        )
+        for product_id, variation_id in lines
+    ]
+    return db.query(models.CartItem).filter(
+        models.CartItem.cart_id == cart_id, or_(*conditions)
+    ).delete(synchronize_session=False)
+
+
+def bump_version(db: Session, cart_id: int):
+    db.query(models.Cart).filter(models.Cart.id == cart_id).update(
+        {models.Cart.version: models.Cart.version + 1}, synchronize_session=False
+    )
+
+
+def sync_cart(db: Session, cart_id: int, changes):
+    # Apply a whole batch from the client in one transaction: removals first
+    # (including "set to 0"), then absolute quantities, then increments
+    additions = {}
+    for line in changes.add:
+        if line.quantity > 0:
+            key = (line.product_id, line.variation_id)
+            additions[key] = additions.get(key, 0) + line.quantity
+    replacements = {}
+    removals = {(line.product_id, line.variation_id) for line in changes.remove}
+    for line in changes.set:
+        key = (line.product_id, line.variation_id)
+        if line.quantity == 0:
+            removals.add(key)
+            replacements.pop(key, None)
+        else:
+            replacements[key] = line.quantity
+            removals.discard(key)
+
+    remove_lines(db, cart_id, removals)
+    upsert_lines(db, cart_id, replacements, replace=True)
+    upsert_lines(db, cart_id, additions)
+    if removals or replacements or additions:
+        bump_version(db, cart_id)
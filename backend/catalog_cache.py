@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import compression
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "512"))
+# Each worker keeps its own cache, so writes made through another worker are
+# only picked up once the entry expires.
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, headers: dict):
+        self.body = body
+        self.headers = headers
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.created_at = time.monotonic()
+        self._encoded = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        # Compressed once per cache entry rather than on every response
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = compression.compress(self.body, encoding)
+        return body
+
+
+class CatalogCache:
+    def __init__(self, max_entries: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get((self.version, key))
+            if entry is None:
+                return None
+            if time.monotonic() - entry.created_at > self.ttl:
+                del self._entries[(self.version, key)]
+                return None
+            self._entries.move_to_end((self.version, key))
+            return entry
+
+    def set(self, key, body: bytes, headers: dict = None, version: int = None):
+        entry = CachedResponse(body, headers or {})
+        with self._lock:
+            # Don't store a response rendered before a concurrent write bumped the version
+            if version is not None and version != self.version:
+                return entry
+            self._entries[(self.version, key)] = entry
+            self._entries.move_to_end((self.version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or ("W/" + etag) in candidates
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,272 @@
+import datetime
+import logging
+import random
+import time
+
+from sqlalchemy import func, select, text
+
+import auth, database, migrations, models, stats
+
+logger = logging.getLogger("miauhome.datagen")
+
+# Synthetic catalog, customers and order history at production scale, for
+# benchmarks and query plans. Rows go in with multi-row INSERTs in batches,
+# with ids assigned here so child rows can reference them without a round trip:
+#   python datagen.py --products 100000 --users 200000 --orders 1000000
+# Every generated user logs in with GENERATED_PASSWORD.
+
+GENERATED_PASSWORD = "miau-bench-123"
+GENERATED_EMAIL_DOMAIN = "bench.miauhome.test"
+
+CATEGORIES = ("Muebles", "Alimentación", "Descanso", "Juguetes", "Higiene", "Accesorios", "Transporte", "Salud")
+WORDS = ("rascador", "cama", "fuente", "juguete", "arena", "gato", "suave", "acolchada", "niveles", "hamaca",
+         "premium", "silenciosa", "filtro", "natural", "resistente", "lavable", "compacta", "madera", "sisal", "felpa",
+         "túnel", "pluma", "ratón", "comedero", "transportín", "cepillo", "collar", "snack", "catnip", "iglú")
+FIRST_NAMES = ("Camila", "Javiera", "Sofía", "Valentina", "Martina", "Benjamín", "Vicente", "Matías", "Agustín", "Tomás")
+LAST_NAMES = ("González", "Muñoz", "Rojas", "Díaz", "Pérez", "Soto", "Contreras", "Silva", "Martínez", "Sepúlveda")
+CAT_NAMES = ("Michi", "Luna", "Simba", "Nala", "Garfield", "Mishi", "Tom", "Cleo", "Milo", "Pelusa")
+CITIES = ("Santiago", "Valparaíso", "Concepción", "La Serena", "Temuco", "Antofagasta", "Puerto Montt")
+VARIATIONS = {
+    "color": ("Gris Ártico", "Beige Arena", "Blanco Minimal", "Azul Noche", "Rosa Palo", "Verde Oliva"),
+    "size": ("Pequeña", "Mediana", "Grande", "XL"),
+    "weight": ("1kg", "3kg", "7kg", "10kg"),
+}
+# status -> relative weight
+ORDER_STATUSES = {"paid": 55, "shipped": 10, "delivered": 10, "pending": 10, "failed": 15}
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count)).capitalize()
+
+
+def next_id(connection, model) -> int:
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def insert_batches(engine, model, rows, batch_size: int) -> int:
+    # rows is a generator; each batch is its own transaction so memory stays
+    # flat and an interrupted run keeps what it already wrote
+    table = model.__table__
+    total = 0
+    batch = []
+    started = time.perf_counter()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with engine.begin() as connection:
+                connection.execute(table.insert(), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        with engine.begin() as connection:
+            connection.execute(table.insert(), batch)
+        total += len(batch)
+    logger.info("%s: %d rows in %.1fs", table.name, total, time.perf_counter() - started)
+    return total
+
+
+def sync_sequences(engine, models_with_ids):
+    # Explicit ids leave Postgres sequences behind; move them past max(id)
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for model in models_with_ids:
+            table = model.__table__.name
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT max(id) FROM {table}), 1))"
+            ))
+
+
+def product_rows(rng: random.Random, first_id: int, count: int):
+    for product_id in range(first_id, first_id + count):
+        yield {
+            "id": product_id,
+            "sku": f"GEN-{product_id:08d}",
+            "name": words(rng, 3),
+            "description": words(rng, rng.randrange(12, 40)),
+            "price": rng.randrange(1990, 149990, 10),
+            "image_url": f"https://images.example.test/products/{product_id}.jpg",
+            "category": rng.choice(CATEGORIES),
+            "stock": rng.choice((0, 0, rng.randrange(1, 200))),
+            "is_active": rng.random() > 0.03,
+        }
+
+
+def variation_rows(rng: random.Random, first_id: int, product_ids: range, per_product: int):
+    variation_id = first_id
+    for product_id in product_ids:
+        variation_type = rng.choice(tuple(VARIATIONS))
+        names = rng.sample(VARIATIONS[variation_type], min(rng.randrange(per_product + 1), len(VARIATIONS[variation_type])))
+        for name in names:
+            yield {
+                "id": variation_id,
+                "product_id": product_id,
+                "name": name,
+                "variation_type": variation_type,
+                "price": rng.choice((None, None, rng.randrange(1990, 149990, 10))),
+                "stock": rng.randrange(0, 60),
+            }
+            variation_id += 1
+
+
+def image_rows(rng: random.Random, first_id: int, product_ids: range, per_product: int):
+    image_id = first_id
+    for product_id in product_ids:
+        for n in range(rng.randrange(per_product + 1)):
+            yield {"id": image_id, "product_id": product_id, "url": f"https://images.example.test/products/{product_id}-{n}.jpg"}
+            image_id += 1
+
+
+def user_rows(rng: random.Random, first_id: int, count: int, hashed_password: str):
+    for user_id in range(first_id, first_id + count):
+        yield {
+            "id": user_id,
+            "email": generated_email(user_id),
+            "hashed_password": hashed_password,
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "cat_name": rng.choice(CAT_NAMES),
+            "cat_breed": None,
+            "is_active": True,
+            "is_admin": False,
+        }
+
+
+def generated_email(user_id: int) -> str:
+    return f"user{user_id}@{GENERATED_EMAIL_DOMAIN}"
+
+
+def cart_rows(user_ids: list, first_id: int, now: datetime.datetime):
+    for cart_id, user_id in enumerate(user_ids, start=first_id):
+        yield {"id": cart_id, "user_id": user_id, "created_at": now, "version": 0}
+
+
+def cart_item_rows(rng: random.Random, first_id: int, cart_ids: range, product_ids: range):
+    item_id = first_id
+    for cart_id in cart_ids:
+        # Distinct products per cart, so the unique line indexes hold
+        for product_id in set(rng.choice(product_ids) for _ in range(rng.randrange(1, 5))):
+            yield {"id": item_id, "cart_id": cart_id, "product_id": product_id, "variation_id": None,
+                   "quantity": rng.randrange(1, 4)}
+            item_id += 1
+
+
+def order_rows(rng: random.Random, first_id: int, count: int, user_ids: range, now: datetime.datetime, days: int,
+               sold: list):
+    statuses = list(ORDER_STATUSES)
+    weights = list(ORDER_STATUSES.values())
+    for order_id in range(first_id, first_id + count):
+        status = rng.choices(statuses, weights)[0]
+        created_at = now - datetime.timedelta(seconds=rng.randrange(days * 86400))
+        guest = not user_ids or rng.random() < 0.3
+        total = rng.randrange(1990, 299990, 10)
+        if status in stats.SOLD_STATUSES:
+            sold.append(order_id)
+        yield {
+            "id": order_id,
+            "user_id": None if guest else rng.choice(user_ids),
+            "total_amount": total,
+            "status": status,
+            "buy_order": f"G{order_id}",
+            "session_id": f"bench-{order_id}",
+            "token_ws": None,
+            "payment_type": "webpay_plus",
+            "created_at": created_at,
+            # Left for stats.backfill, which stamps sold orders and builds rollups
+            "paid_at": None,
+            "guest_email": f"guest{order_id}@{GENERATED_EMAIL_DOMAIN}" if guest else None,
+            "guest_address": f"{words(rng, 2)} {rng.randrange(1, 9999)}, {rng.choice(CITIES)}" if guest else None,
+        }
+
+
+def reservation_rows(rng: random.Random, first_id: int, order_ids: list, product_ids: range, now: datetime.datetime):
+    # One committed line per sold order, enough for the category rollups
+    for reservation_id, order_id in enumerate(order_ids, start=first_id):
+        yield {"id": reservation_id, "order_id": order_id, "product_id": rng.choice(product_ids), "variation_id": None,
+               "quantity": rng.randrange(1, 4), "status": "committed", "created_at": now, "expires_at": now}
+
+
+def discount_rows(rng: random.Random, first_id: int, count: int, now: datetime.datetime):
+    for discount_id in range(first_id, first_id + count):
+        yield {
+            "id": discount_id,
+            "code": f"BENCH{discount_id:05d}",
+            "percentage": rng.choice((5, 10, 15, 20, 30)),
+            # Some already expired, so lookups see both kinds
+            "valid_until": now + datetime.timedelta(days=rng.randrange(-30, 180)),
+            "is_active": rng.random() > 0.1,
+        }
+
+
+def generate(engine, products: int, variations: int, images: int, users: int, cart_ratio: float, orders: int,
+             discounts: int, days: int, seed: int, batch_size: int):
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        first = {model: next_id(connection, model) for model in (
+            models.Product, models.ProductVariation, models.ProductImage, models.User, models.Cart,
+            models.CartItem, models.Order, models.StockReservation, models.Discount
+        )}
+        existing_products = connection.execute(select(func.count(models.Product.id))).scalar()
+        existing_users = connection.execute(select(func.count(models.User.id))).scalar()
+
+    product_ids = range(first[models.Product], first[models.Product] + products)
+    insert_batches(engine, models.Product, product_rows(rng, product_ids.start, products), batch_size)
+    insert_batches(engine, models.ProductVariation, variation_rows(rng, first[models.ProductVariation], product_ids, variations), batch_size)
+    insert_batches(engine, models.ProductImage, image_rows(rng, first[models.ProductImage], product_ids, images), batch_size)
+
+    # bcrypt once: every generated user shares the hash
+    hashed_password = auth.get_password_hash(GENERATED_PASSWORD)
+    user_ids = range(first[models.User], first[models.User] + users)
+    insert_batches(engine, models.User, user_rows(rng, user_ids.start, users, hashed_password), batch_size)
+
+    if not product_ids and (orders or cart_ratio) and existing_products:
+        with engine.connect() as connection:
+            low, high = connection.execute(select(func.min(models.Product.id), func.max(models.Product.id))).one()
+        product_ids = range(low, high + 1)
+    if product_ids:
+        cart_users = [user_id for user_id in user_ids if rng.random() < cart_ratio]
+        cart_ids = range(first[models.Cart], first[models.Cart] + len(cart_users))
+        insert_batches(engine, models.Cart, cart_rows(cart_users, cart_ids.start, now), batch_size)
+        insert_batches(engine, models.CartItem, cart_item_rows(rng, first[models.CartItem], cart_ids, product_ids), batch_size)
+
+    sold = []
+    insert_batches(engine, models.Order, order_rows(rng, first[models.Order], orders, user_ids, now, days, sold), batch_size)
+    if product_ids:
+        insert_batches(engine, models.StockReservation, reservation_rows(rng, first[models.StockReservation], sold, product_ids, now), batch_size)
+    insert_batches(engine, models.Discount, discount_rows(rng, first[models.Discount], discounts, now), batch_size)
+
+    sync_sequences(engine, list(first))
+    if orders:
+        session = database.SessionLocal()
+        try:
+            started = time.perf_counter()
+            stats.backfill(session)
+            logger.info("Rebuilt sales rollups in %.1fs", time.perf_counter() - started)
+        finally:
+            session.close()
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("ANALYZE"))
+    logger.info("Done (the database already had %d products and %d users)", existing_products, existing_users)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fill the database with synthetic MiauHome data")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--variations", type=int, default=4, help="max variations per product")
+    parser.add_argument("--images", type=int, default=3, help="max extra images per product")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--cart-ratio", type=float, default=0.3, help="share of new users with a saved cart")
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--discounts", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365, help="spread orders over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    generate(database.engine, args.products, args.variations, args.images, args.users, args.cart_ratio,
+             args.orders, args.discounts, args.days, args.seed, args.batch_size)
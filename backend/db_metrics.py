@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+import traceback
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+logger = logging.getLogger("miauhome.db")
+
+# Sessions held longer than this (seconds) are reported as possible leaks
+DB_SESSION_LEAK_SECONDS = float(os.getenv("DB_SESSION_LEAK_SECONDS", "30"))
+# Capture the opening stack of every session so leak reports say where it came from
+DB_SESSION_LEAK_TRACE = os.getenv("DB_SESSION_LEAK_TRACE", "0").lower() in ("1", "true", "yes")
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            data = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "timeouts": self.timeouts,
+                "wait_count": self.wait_count,
+                "wait_seconds_total": self.wait_total,
+                "wait_seconds_max": self.wait_max,
+                "wait_seconds_avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            }
+        if isinstance(self.pool, QueuePool):
+            data.update(size=self.pool.size(), overflow=max(self.pool.overflow(), 0), idle=self.pool.checkedin())
+        return data
+
+
+class TimedCheckoutMixin:
+    # Pool events fire only once a connection has been handed out, so the wait
+    # for a free slot is timed around _do_get instead.
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                with self.metrics._lock:
+                    self.metrics.timeouts += 1
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        if self.metrics is not None:
+            self.metrics.pool = pool
+        return pool
+
+
+class TimedQueuePool(TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+pool_metrics = {}
+
+
+def instrument_engine(engine, name: str):
+    metrics = PoolMetrics(name)
+    metrics.pool = engine.pool
+    if isinstance(engine.pool, TimedCheckoutMixin):
+        engine.pool.metrics = metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.connects += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with metrics._lock:
+            metrics.checkouts += 1
+            metrics.in_use += 1
+            metrics.max_in_use = max(metrics.max_in_use, metrics.in_use)
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.checkins += 1
+            metrics.in_use = max(metrics.in_use - 1, 0)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with metrics._lock:
+            metrics.invalidations += 1
+
+    pool_metrics[name] = metrics
+    return metrics
+
+
+class SessionLeakDetector:
+    def __init__(self, threshold: float = DB_SESSION_LEAK_SECONDS, trace: bool = DB_SESSION_LEAK_TRACE):
+        self.threshold = threshold
+        self.trace = trace
+        self.leaks_reported = 0
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def opened(self, session):
+        stack = "".join(traceback.format_stack(limit=12)[:-1]) if self.trace else None
+        with self._lock:
+            self._open[id(session)] = (time.monotonic(), stack)
+        return id(session)
+
+    def closed(self, token):
+        with self._lock:
+            started, stack = self._open.pop(token, (None, None))
+        if started is None:
+            return
+        held = time.monotonic() - started
+        if held > self.threshold:
+            with self._lock:
+                self.leaks_reported += 1
+            logger.warning("DB session held for %.1fs (threshold %.1fs)%s",
+                           held, self.threshold, "\nOpened at:\n" + stack if stack else "")
+
+    def long_held(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"held_seconds": now - started, "opened_at": stack}
+                for started, stack in self._open.values()
+                if now - started > self.threshold
+            ]
+
+    def snapshot(self):
+        with self._lock:
+            open_sessions = len(self._open)
+            leaks_reported = self.leaks_reported
+        return {
+            "open_sessions": open_sessions,
+            "threshold_seconds": self.threshold,
+            "leaks_reported": leaks_reported,
+            "long_held": self.long_held(),
+        }
+
+
+session_leaks = SessionLeakDetector()
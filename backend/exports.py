@@ -0,0 +1,73 @@
+import csv
+import datetime
+import io
+import json
+import os
+import re
+
+from fastapi.responses import StreamingResponse
+
+import database
+
+# Rows fetched from the server-side cursor (and written out) per chunk
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+# Plain signed decimals, not "-inf" or "1_000" which float() would also take
+SIGNED_NUMBER = re.compile(r"[+-](\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def csv_value(value):
+    # Spreadsheet apps run cells starting with these as formulas. Signed
+    # numbers ("-5", "+3.2") can't run anything and are left as they are.
+    if isinstance(value, str) and (
+        value[:1] in ("=", "@", "\t", "\r") or (value[:1] in ("+", "-") and not SIGNED_NUMBER.fullmatch(value))
+    ):
+        return "'" + value
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_rows(stmt, fmt: str):
+    # Runs on the thread pool (StreamingResponse iterates sync generators there)
+    # with its own session. yield_per makes the driver use a server-side cursor,
+    # so only one chunk of rows is ever held in memory.
+    db = database.SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        columns = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(columns)
+        for rows in result.partitions():
+            for row in rows:
+                if fmt == "csv":
+                    writer.writerow([csv_value(value) for value in row])
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row)), default=json_default))
+                    buffer.write("\n")
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
+
+
+def export_response(stmt, fmt: str, name: str):
+    filename = f"{name}_{datetime.date.today():%Y%m%d}.{fmt}"
+    return StreamingResponse(
+        stream_rows(stmt, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,96 @@
+from typing import List, Optional
+
+from fastapi import HTTPException
+from pydantic import ConfigDict, TypeAdapter, create_model
+from sqlalchemy.orm import Session
+
+import models, schemas
+
+
+class Projection:
+    # A subset of a response schema's fields, picked with ?fields=. Named
+    # projections ("card", "detail") expand to their fields. Only the selected
+    # columns are SELECTed, and a relationship is only queried when asked for.
+    def __init__(self, model, schema, named: dict, relations: dict = None):
+        self.model = model
+        self.schema = schema
+        self.fields = tuple(schema.model_fields)
+        self.named = {**named, "detail": self.fields}
+        # field -> foreign key column on the related table
+        self.relations = relations or {}
+        self._models = {}
+
+    def parse(self, value: Optional[str]) -> Optional[tuple]:
+        # None means the whole schema, served by the regular response path
+        if not value:
+            return None
+        requested = {"id"}
+        for token in filter(None, (part.strip() for part in value.split(","))):
+            if token in self.named:
+                requested.update(self.named[token])
+            elif token in self.fields:
+                requested.add(token)
+            else:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unknown field '{token}'. Use {', '.join(self.named)} or any of: {', '.join(self.fields)}"
+                )
+        if requested.issuperset(self.fields):
+            return None
+        return tuple(field for field in self.fields if field in requested)
+
+    def columns(self, fields: tuple, extra: tuple = ()):
+        names = [field for field in fields if field not in self.relations]
+        names += [name for name in extra if name not in names]
+        return [getattr(self.model, name) for name in names]
+
+    def _compiled(self, fields: tuple):
+        compiled = self._models.get(fields)
+        if compiled is None:
+            partial = create_model(
+                f"{self.schema.__name__}Fields",
+                __config__=ConfigDict(from_attributes=True),
+                **{field: (self.schema.model_fields[field].annotation, self.schema.model_fields[field]) for field in fields}
+            )
+            compiled = self._models[fields] = (partial, TypeAdapter(List[partial]))
+        return compiled
+
+    def items(self, db: Session, rows, fields: tuple) -> list:
+        # Rows come from a query over self.columns(fields); requested
+        # relationships are loaded with one IN query each, like selectinload
+        items = [row._asdict() for row in rows]
+        ids = [item["id"] for item in items]
+        for name, foreign_key in self.relations.items():
+            if name not in fields:
+                continue
+            related = foreign_key.class_
+            grouped = {}
+            if ids:
+                for child in db.query(related).filter(foreign_key.in_(ids)).order_by(related.id):
+                    grouped.setdefault(getattr(child, foreign_key.key), []).append(child)
+            for item in items:
+                item[name] = grouped.get(item["id"], [])
+        return items
+
+    def dump(self, db: Session, rows, fields: tuple) -> bytes:
+        adapter = self._compiled(fields)[1]
+        return adapter.dump_json(adapter.validate_python(self.items(db, rows, fields), from_attributes=True))
+
+    def dump_one(self, db: Session, row, fields: tuple) -> bytes:
+        partial = self._compiled(fields)[0]
+        return partial.model_validate(self.items(db, [row], fields)[0], from_attributes=True).model_dump_json().encode()
+
+
+product_fields = Projection(
+    models.Product,
+    schemas.Product,
+    # Everything ProductCard renders: the description line and variation chips included
+    named={"card": ("id", "name", "description", "price", "image_url", "category", "variations")},
+    relations={"variations": models.ProductVariation.product_id, "images": models.ProductImage.product_id},
+)
+
+order_fields = Projection(
+    models.Order,
+    schemas.Order,
+    named={"summary": ("id", "status", "total_amount", "created_at")},
+)
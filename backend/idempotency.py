@@ -0,0 +1,115 @@
+import datetime
+import hashlib
+import json
+import os
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# How long a retry waits for the original in-flight request before giving up
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+# An in_progress key older than this is taken to belong to a worker that died
+# mid-request, and the next retry takes it over. Must outlast a whole checkout,
+# Transbank round trip (TRANSBANK_TIMEOUT) included.
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+def request_fingerprint(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim_key(db: Session, key: str, fingerprint: str):
+    # Returns None when this request now owns the key and should do the work,
+    # otherwise the (status, response_body) of the request that claimed it first.
+    now = datetime.datetime.utcnow()
+    lease = datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+    record = models.IdempotencyKey(
+        key=key,
+        request_hash=fingerprint,
+        status="in_progress",
+        expires_at=now + datetime.timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        locked_until=now + lease
+    )
+    db.add(record)
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+
+    existing = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).first()
+    if existing is None:
+        # Released between our insert and this read: try once more
+        return claim_key(db, key, fingerprint)
+    if existing.request_hash != fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+    if existing.expires_at < now:
+        db.delete(existing)
+        db.commit()
+        return claim_key(db, key, fingerprint)
+    if existing.status == "in_progress":
+        # Keys claimed before leases existed fall back to their creation time
+        locked_until = existing.locked_until or existing.created_at + lease
+        if locked_until < now:
+            # Only one retry wins the takeover: the UPDATE matches the lease it read
+            taken = db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.id == existing.id,
+                models.IdempotencyKey.status == "in_progress",
+                models.IdempotencyKey.locked_until.is_(None) if existing.locked_until is None
+                else models.IdempotencyKey.locked_until == existing.locked_until
+            ).update({models.IdempotencyKey.locked_until: now + lease}, synchronize_session=False)
+            db.commit()
+            if taken:
+                return None
+            return key_state(db, key)
+    return existing.status, existing.response_body
+
+
+def key_state(db: Session, key: str):
+    row = db.query(
+        models.IdempotencyKey.status, models.IdempotencyKey.response_body
+    ).filter(models.IdempotencyKey.key == key).first()
+    # End the read transaction so no connection is held while the caller waits
+    db.rollback()
+    return (row.status, row.response_body) if row else None
+
+
+def complete_key(db: Session, key: str, response: dict, order_id: int = None):
+    # Called inside the caller's transaction so the stored response and the
+    # order it describes commit together
+    db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).update(
+        {
+            models.IdempotencyKey.status: "completed",
+            models.IdempotencyKey.response_body: json.dumps(response),
+            models.IdempotencyKey.order_id: order_id,
+        },
+        synchronize_session=False
+    )
+
+
+def release_key(db: Session, key: str):
+    # The request failed before completing: let the client retry with the same key
+    db.rollback()
+    db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.status == "in_progress"
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def purge_expired(db: Session, batch_size: int = 1000) -> int:
+    expired_ids = db.query(models.IdempotencyKey.id).filter(
+        models.IdempotencyKey.expires_at < datetime.datetime.utcnow()
+    ).limit(batch_size).subquery()
+    deleted = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.id.in_(expired_ids.select())
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
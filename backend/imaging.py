@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger("miauhome.images")
+
+IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+# Only these widths are ever rendered, so URLs can't be used to fill the disk
+IMAGE_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_WIDTHS", "160,320,640,1024,1600").split(","))
+# Rendered as soon as an image is uploaded; everything else on first request
+IMAGE_PREGENERATE_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_PREGENERATE_WIDTHS", "320,640").split(","))
+# Disk used by rendered variants; originals are never evicted
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", str(IMAGE_WORKERS * 16)))
+
+# Pillow wheels only encode AVIF from 11.3 on, and only when built with libavif
+AVIF_SUPPORTED = features.check("avif")
+
+# Variant format -> (Pillow format, media type, save options)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+if AVIF_SUPPORTED:
+    VARIANT_FORMATS = {"avif": ("AVIF", "image/avif", {"quality": 55, "speed": 6}), **VARIANT_FORMATS}
+PREGENERATE_FORMATS = tuple(fmt for fmt in ("avif", "webp") if fmt in VARIANT_FORMATS)
+ORIGINAL_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif", "AVIF": "avif"}
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif", "avif": "image/avif"}
+
+# URLs carry the content hash, so a given URL always serves the same bytes
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class ImagePoolSaturated(Exception):
+    pass
+
+
+def originals_dir() -> str:
+    return os.path.join(IMAGE_STORAGE_DIR, "originals")
+
+
+def variants_dir() -> str:
+    return os.path.join(IMAGE_STORAGE_DIR, "variants")
+
+
+def original_path(digest: str, extension: str) -> str:
+    return os.path.join(originals_dir(), f"{digest}.{extension}")
+
+
+def variant_path(digest: str, width: int, fmt: str) -> str:
+    return os.path.join(variants_dir(), digest[:2], f"{digest}_{width}.{fmt}")
+
+
+def find_original(digest: str):
+    for extension in ORIGINAL_FORMATS.values():
+        path = original_path(digest, extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def store_original(data: bytes):
+    # Runs on the thread pool. Returns (digest, extension); the same file
+    # uploaded twice is stored once.
+    if len(data) > IMAGE_MAX_UPLOAD_BYTES:
+        raise InvalidImage("Image is too large")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            extension = ORIGINAL_FORMATS.get(image.format)
+            pixels = image.width * image.height
+            image.verify()
+    except Exception:
+        raise InvalidImage("File is not a supported image")
+    if extension is None:
+        raise InvalidImage("Unsupported image format")
+    if pixels > IMAGE_MAX_PIXELS:
+        raise InvalidImage("Image dimensions are too large")
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    path = original_path(digest, extension)
+    if not os.path.exists(path):
+        write_atomic(path, data)
+    return digest, extension
+
+
+def render_variant(source: str, target: str, width: int, fmt: str) -> int:
+    # Runs in a worker process. Never upscales; returns the file size.
+    pil_format, _, options = VARIANT_FORMATS[fmt]
+    with Image.open(source) as image:
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, image.height), Image.LANCZOS)
+        if pil_format == "JPEG":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format, **options)
+    write_atomic(target, buffer.getvalue())
+    return len(buffer.getvalue())
+
+
+class VariantCache:
+    # Size-bounded LRU over the variant files. Recency is kept in the file
+    # mtime, so the order survives restarts. Each worker keeps its own index;
+    # a file evicted by another worker is simply rendered again.
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        files = []
+        for root, _, names in os.walk(variants_dir()):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            for _, path, size in sorted(files):
+                self._entries[path] = size
+                self.total_bytes += size
+        self._evict()
+
+    def touch(self, path: str) -> bool:
+        if not os.path.exists(path):
+            with self._lock:
+                self.total_bytes -= self._entries.pop(path, 0)
+            return False
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            else:
+                self._entries[path] = os.path.getsize(path)
+                self.total_bytes += self._entries[path]
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def add(self, path: str, size: int):
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes or len(self._entries) <= 1:
+                    return
+                path, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+
+class ImagePipeline:
+    def __init__(self, workers: int = IMAGE_WORKERS, max_pending: int = IMAGE_MAX_PENDING):
+        self.workers = workers
+        self.cache = VariantCache()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        # One render per variant at a time; concurrent requests share it
+        self._in_flight = {}
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ImagePoolSaturated()
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return asyncio.wrap_future(future)
+
+    async def variant(self, digest: str, width: int, fmt: str):
+        # Path of the rendered variant, or None if the original doesn't exist
+        target = variant_path(digest, width, fmt)
+        if self.cache.touch(target):
+            return target
+        render = self._in_flight.get(target)
+        if render is None:
+            source = find_original(digest)
+            if source is None:
+                return None
+            render = asyncio.ensure_future(self._submit(render_variant, source, target, width, fmt))
+            self._in_flight[target] = render
+            render.add_done_callback(lambda _: self._in_flight.pop(target, None))
+            size = await render
+            self.cache.add(target, size)
+        else:
+            await render
+        return target
+
+    async def pregenerate(self, digest: str):
+        for width in IMAGE_PREGENERATE_WIDTHS:
+            for fmt in PREGENERATE_FORMATS:
+                try:
+                    await self.variant(digest, width, fmt)
+                except ImagePoolSaturated:
+                    return
+
+    def start(self):
+        # The cache index is rebuilt from disk by the caller, off the startup path
+        os.makedirs(originals_dir(), exist_ok=True)
+        os.makedirs(variants_dir(), exist_ok=True)
+        if not AVIF_SUPPORTED:
+            logger.warning("Pillow has no AVIF encoder: serving WebP/JPEG variants only, build the storefront with NEXT_PUBLIC_IMAGE_AVIF=0")
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def image_urls(base_url: str, digest: str, extension: str):
+    base = f"{base_url.rstrip('/')}/images/{digest}"
+    return {
+        "url": f"{base}.{extension}",
+        "variants": {fmt: {str(width): f"{base}/{width}.{fmt}" for width in IMAGE_WIDTHS} for fmt in VARIANT_FORMATS},
+    }
+
+
+image_pipeline = ImagePipeline()
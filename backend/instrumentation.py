@@ -0,0 +1,229 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+from db_metrics import pool_metrics
+
+logger = logging.getLogger("miauhome.perf")
+
+# Log requests slower than this (seconds) with the SQL they ran; 0 turns it off
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+# How many distinct statements a slow-request entry lists, slowest first
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "10"))
+# The same statement this many times in one request is reported as an N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    # Cumulative buckets per label set, in the Prometheus exposition layout
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, label_names: tuple):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(series):
+            base = format_labels(label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, label_names: tuple):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{{{format_labels(label_names, labels)}}} {value}")
+        return lines
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def one_line(statement: str) -> str:
+    return " ".join(statement.split())
+
+
+class RequestStats:
+    # SQL issued on behalf of one request. The handlers' DB work runs on the
+    # thread pool (or run_sync), which inherits the request's context, so the
+    # cursor hooks find this object through current_request.
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # statement -> [executions, seconds]
+        self.statements = {}
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.db_seconds += seconds
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def repeated(self, threshold: int):
+        return [(statement, count) for statement, (count, _) in self.statements.items() if count >= threshold]
+
+    def slowest(self, limit: int):
+        return sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = Counter("http_requests_total", "HTTP requests by route and status")
+        self.latency = Histogram("http_request_duration_seconds", "Request latency by route", LATENCY_BUCKETS)
+        self.queries = Histogram("db_queries_per_request", "SQL statements issued per request", QUERY_COUNT_BUCKETS)
+        self.db_seconds = Counter("db_query_seconds_total", "Time spent in SQL by route")
+        self.n_plus_one = Counter("db_repeated_statements_total", "Requests that repeated a statement N_PLUS_ONE_THRESHOLD times or more")
+        self.slow_requests = Counter("http_slow_requests_total", "Requests over SLOW_REQUEST_SECONDS")
+        self._reported = set()
+        self._lock = threading.Lock()
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        self.requests.inc((method, route, str(status)))
+        self.latency.observe((method, route), seconds)
+        self.queries.observe((method, route), stats.queries)
+        self.db_seconds.inc((method, route), stats.db_seconds)
+
+        repeated = stats.repeated(N_PLUS_ONE_THRESHOLD)
+        if repeated:
+            self.n_plus_one.inc((method, route))
+            for statement, count in repeated:
+                # Warn once per route and statement, the counter keeps the rate
+                with self._lock:
+                    if (route, statement) in self._reported:
+                        continue
+                    self._reported.add((route, statement))
+                logger.warning("Possible N+1 on %s %s: statement ran %d times in one request: %s",
+                               method, route, count, one_line(statement))
+
+        if SLOW_REQUEST_SECONDS and seconds >= SLOW_REQUEST_SECONDS:
+            self.slow_requests.inc((method, route))
+            logger.warning(
+                "Slow request %s %s: %.3fs, %d queries, %.3fs in SQL%s", method, route, seconds,
+                stats.queries, stats.db_seconds,
+                "".join(f"\n  {count}x {total:.3f}s  {one_line(statement)}"
+                        for statement, (count, total) in stats.slowest(SLOW_REQUEST_MAX_STATEMENTS))
+            )
+
+    def render(self) -> str:
+        lines = []
+        lines += self.requests.render(("method", "route", "status"))
+        lines += self.latency.render(("method", "route"))
+        lines += self.queries.render(("method", "route"))
+        lines += self.db_seconds.render(("method", "route"))
+        lines += self.n_plus_one.render(("method", "route"))
+        lines += self.slow_requests.render(("method", "route"))
+        for key, name, kind, help_text in (
+            ("in_use", "db_pool_in_use", "gauge", "Connections checked out of the pool"),
+            ("checkouts", "db_pool_checkouts_total", "counter", "Pool checkouts"),
+            ("timeouts", "db_pool_timeouts_total", "counter", "Pool checkouts that timed out"),
+            ("wait_seconds_total", "db_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for pool_name, pool in sorted(pool_metrics.items()):
+                lines.append(f'{name}{{pool="{pool_name}"}} {pool.snapshot()[key]}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrument_queries(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_request.get() is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_request.get()
+        started = getattr(context, "_query_started", None)
+        if stats is not None and started is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+
+class InstrumentationMiddleware:
+    # Outermost middleware: latency covers compression and CORS too. Requests
+    # that match no route share one label so stray paths can't blow up the
+    # series count.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+        finished = None
+
+        async def send_wrapper(message):
+            nonlocal status_code, finished
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Background tasks run after this; they don't count as latency
+                finished = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            metrics.record(
+                scope["method"], getattr(route, "path", "unmatched"), status_code,
+                (finished or time.perf_counter()) - started, stats
+            )
@@ -1,101 +1,164 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, Header, UploadFile, File, Request, BackgroundTasks, Path
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-import models, schemas, auth, database
-from transbank.common.integration_type import IntegrationType
-from transbank_logic import TransbankService
+from pydantic import TypeAdapter
+from sqlalchemy import case, func, or_, select, tuple_
+from sqlalchemy.orm import Session, selectinload
+from starlette.concurrency import run_in_threadpool
+import models, schemas, auth, database, search, idempotency, carts, stock, stats, exports, product_import, product_updates, migrations, imaging, compression, pricing
+from catalog_cache import catalog_cache, etag_matches
+from user_cache import user_cache
+from db_metrics import pool_metrics, session_leaks
+from password_hashing import password_hasher, needs_rehash, HashingPoolSaturated
+from transbank_logic import payment_gateway, PaymentGatewayUnavailable
+from imaging import image_pipeline
+from compression import CompressionMiddleware
+from instrumentation import InstrumentationMiddleware, METRICS_TOKEN, metrics
+from responses import FastJSONResponse, trusted_json
+from fieldsets import product_fields, order_fields
+import asyncio
+import datetime
+import json
+import logging
+import time
 import uuid
 import os
 from typing import Optional, List
 
-models.Base.metadata.create_all(bind=database.engine)
-
 app = FastAPI(title="MiauHome API")
 
+checkout_logger = logging.getLogger("miauhome.checkout")
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Estimated-Total", "ETag", "Content-Disposition"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(InstrumentationMiddleware)
+
+# Cart, catalog, order and checkout handlers are async. Their DB work goes
+# through database.AsyncDB, which runs it on the async engine when DB_ASYNC
+# is set and on the sync engine's thread pool otherwise.
+
+def cart_etag(cart):
+    return f'"cart-{cart.id}-{cart.version}"'
+
+@app.get("/cart/pricing", response_model=schemas.CartPricing)
+async def get_cart_pricing(
+    discount_code: Optional[str] = Query(None, max_length=64),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    def price(db: Session):
+        try:
+            return pricing.quote_saved_cart(db, current_user.id, discount_code)
+        except pricing.PricingError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await db.run(price)
 
 @app.get("/cart", response_model=schemas.Cart)
-def get_cart(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
-    if not cart:
-        cart = models.Cart(user_id=current_user.id)
-        db.add(cart)
+async def get_cart(
+    response: Response,
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    if_none_match: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    def fetch_cart(db: Session):
+        if if_none_match:
+            # Cheap version check first: an unchanged cart is not loaded at all
+            row = db.query(models.Cart.id, models.Cart.version).filter(models.Cart.user_id == current_user.id).first()
+            if row and etag_matches(if_none_match, cart_etag(row)):
+                return None, cart_etag(row)
+        cart = carts.load_cart(db, current_user.id)
+        if not cart:
+            carts.ensure_cart_id(db, current_user.id)
+            db.commit()
+            cart = carts.load_cart(db, current_user.id)
+        cart = schemas.Cart.model_validate(cart)
+        return cart, cart_etag(cart)
+
+    cart, etag = await db.run(fetch_cart)
+    if cart is None:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return cart
+
+@app.put("/cart", response_model=schemas.Cart)
+async def sync_cart(
+    changes: schemas.CartSync,
+    response: Response,
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    def apply_changes(db: Session):
+        cart_id = carts.ensure_cart_id(db, current_user.id)
+        carts.sync_cart(db, cart_id, changes)
         db.commit()
-        db.refresh(cart)
+        return schemas.Cart.model_validate(carts.load_cart(db, current_user.id))
+
+    cart = await db.run(apply_changes)
+    response.headers["ETag"] = cart_etag(cart)
     return cart
 
 @app.post("/cart/items", response_model=schemas.Cart)
-def add_to_cart(
+async def add_to_cart(
     item_in: schemas.CartItemCreate,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    response: Response,
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: database.AsyncDB = Depends(database.get_async_db)
 ):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
-    if not cart:
-        cart = models.Cart(user_id=current_user.id)
-        db.add(cart)
+    def add_item(db: Session):
+        cart_id = carts.ensure_cart_id(db, current_user.id)
+        carts.add_item(db, cart_id, item_in.product_id, item_in.variation_id, item_in.quantity)
         db.commit()
-        db.refresh(cart)
-        
-    # Check if item already exists
-    cart_item = db.query(models.CartItem).filter(
-        models.CartItem.cart_id == cart.id,
-        models.CartItem.product_id == item_in.product_id,
-        models.CartItem.variation_id == item_in.variation_id
-    ).first()
-    
-    if cart_item:
-        cart_item.quantity += item_in.quantity
-    else:
-        cart_item = models.CartItem(
-            cart_id=cart.id,
-            product_id=item_in.product_id,
-            variation_id=item_in.variation_id,
-            quantity=item_in.quantity
-        )
-        db.add(cart_item)
-        
-    db.commit()
-    db.refresh(cart)
+        return schemas.Cart.model_validate(carts.load_cart(db, current_user.id))
+
+    cart = await db.run(add_item)
+    response.headers["ETag"] = cart_etag(cart)
     return cart
 
 @app.delete("/cart/items/{product_id}", response_model=schemas.Cart)
-def remove_from_cart(
+async def remove_from_cart(
     product_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    response: Response,
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: database.AsyncDB = Depends(database.get_async_db)
 ):
-    cart = db.query(models.Cart).filter(models.Cart.user_id == current_user.id).first()
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-        
-    cart_item = db.query(models.CartItem).filter(
-        models.CartItem.cart_id == cart.id,
-        models.CartItem.product_id == product_id
-    ).first()
-    
-    if not cart_item:
-        raise HTTPException(status_code=404, detail="Item not found in cart")
+    def remove_item(db: Session):
+        cart_id = db.query(models.Cart.id).filter(models.Cart.user_id == current_user.id).scalar()
+        if cart_id is None:
+            raise HTTPException(status_code=404, detail="Cart not found")
+            
+        deleted = db.query(models.CartItem).filter(
+            models.CartItem.id == db.query(models.CartItem.id).filter(
+                models.CartItem.cart_id == cart_id,
+                models.CartItem.product_id == product_id
+            ).order_by(models.CartItem.id).limit(1).scalar_subquery()
+        ).delete(synchronize_session=False)
         
-    db.delete(cart_item)
-    db.commit()
-    db.refresh(cart)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Item not found in cart")
+            
+        carts.bump_version(db, cart_id)
+        db.commit()
+        return schemas.Cart.model_validate(carts.load_cart(db, current_user.id))
+
+    cart = await db.run(remove_item)
+    response.headers["ETag"] = cart_etag(cart)
     return cart
 
 @app.on_event("startup")
 def startup_event():
+    migrations.ensure_current(database.engine)
     db = next(database.get_db())
-    # Create tables if they don't exist
-    models.Base.metadata.create_all(bind=database.engine)
-    
+
     # Create default admin if not exists
-    if db.query(models.User).filter(models.User.email == "admin@miauhome.cl").count() == 0:
+    if db.query(models.User.id).filter(models.User.email == "admin@miauhome.cl").first() is None:
         admin_user = models.User(
             email="admin@miauhome.cl",
             hashed_password=auth.get_password_hash("admin123"),
@@ -106,10 +169,11 @@ def startup_event():
         db.add(admin_user)
         db.commit()
 
-    if db.query(models.Product).count() == 0:
+    if db.query(models.Product.id).first() is None:
         # Seed products matching frontend data
         products_data = [
             {
+                "sku": 'MH-0001',
                 "name": 'Rascador Deluxe Premium', 
                 "price": 45990, 
                 "category": 'Muebles', 
@@ -121,6 +185,7 @@ def startup_event():
                 ]
             },
             {
+                "sku": 'MH-0002',
                 "name": 'Fuente de Agua Inteligente', 
                 "price": 32990, 
                 "category": 'Alimentación', 
@@ -132,6 +197,7 @@ def startup_event():
                 ]
             },
             {
+                "sku": 'MH-0003',
                 "name": 'Cama Iglú Acolchada', 
                 "price": 24990, 
                 "category": 'Descanso', 
@@ -144,6 +210,7 @@ def startup_event():
                 ]
             },
             {
+                "sku": 'MH-0004',
                 "name": 'Juguete Láser Automático', 
                 "price": 15990, 
                 "category": 'Juguetes', 
@@ -155,136 +222,507 @@ def startup_event():
             }
         ]
         
-        for p_data in products_data:
-            vars_data = p_data.pop("variations", [])
-            db_product = models.Product(**p_data)
-            db.add(db_product)
-            db.commit()
-            db.refresh(db_product)
-            for v_data in vars_data:
-                db_var = models.ProductVariation(**v_data, product_id=db_product.id)
-                db.add(db_var)
-        db.commit()
+        product_import.import_chunk(db, [schemas.ProductImport(**p_data) for p_data in products_data])
+
+def hashing_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Authentication service busy, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+def sweep_expired():
+    # Expired stock reservations and idempotency keys, in batches so a large
+    # backlog never turns into one long transaction
+    db = database.SessionLocal()
+    try:
+        while stock.release_expired(db, stock.STOCK_SWEEP_BATCH) == stock.STOCK_SWEEP_BATCH:
+            pass
+        while idempotency.purge_expired(db, stock.STOCK_SWEEP_BATCH) == stock.STOCK_SWEEP_BATCH:
+            pass
+    finally:
+        db.close()
+
+async def run_sweeper():
+    while True:
+        await asyncio.sleep(stock.STOCK_SWEEP_INTERVAL)
+        try:
+            await run_in_threadpool(sweep_expired)
+        except Exception:
+            stock.logger.exception("Sweeping expired reservations failed")
+
+sweeper_task = None
+
+@app.on_event("startup")
+async def start_sweeper():
+    global sweeper_task
+    sweeper_task = asyncio.create_task(run_sweeper())
+
+@app.on_event("startup")
+async def start_image_pipeline():
+    image_pipeline.start()
+    asyncio.get_running_loop().run_in_executor(None, image_pipeline.cache.load)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if sweeper_task is not None:
+        sweeper_task.cancel()
+    password_hasher.shutdown()
+    image_pipeline.shutdown()
+    await payment_gateway.close()
 
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if db_user:
+async def register(user: schemas.UserCreate, db: database.AsyncDB = Depends(database.get_async_db)):
+    # Only the bcrypt work leaves the request path; DB access goes through AsyncDB
+    def email_taken(db: Session):
+        return db.query(models.User.id).filter(models.User.email == user.email).first() is not None
+
+    if await db.run(email_taken):
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = auth.get_password_hash(user.password)
-    new_user = models.User(
-        email=user.email, 
-        hashed_password=hashed_password, 
-        first_name=user.first_name,
-        last_name=user.last_name,
-        cat_name=user.cat_name,
-        cat_breed=user.cat_breed
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    
-    # Create address if provided
-    if user.address:
-        db_address = models.UserAddress(
-            user_id=new_user.id,
-            address_line=user.address,
-            city=user.city or "Santiago",
-            region=user.region or "Metropolitana"
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except HashingPoolSaturated:
+        raise hashing_busy()
+
+    def create_user(db: Session):
+        new_user = models.User(
+            email=user.email, 
+            hashed_password=hashed_password, 
+            first_name=user.first_name,
+            last_name=user.last_name,
+            cat_name=user.cat_name,
+            cat_breed=user.cat_breed
         )
-        db.add(db_address)
-    
-    # Create configuration
-    config = models.UserConfiguration(user_id=new_user.id)
-    db.add(config)
-    
-    # Create cart
-    cart = models.Cart(user_id=new_user.id)
-    db.add(cart)
-    db.commit()
-    
-    return new_user
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+        
+        # Create address if provided
+        if user.address:
+            db_address = models.UserAddress(
+                user_id=new_user.id,
+                address_line=user.address,
+                city=user.city or "Santiago",
+                region=user.region or "Metropolitana"
+            )
+            db.add(db_address)
+        
+        # Create configuration
+        config = models.UserConfiguration(user_id=new_user.id)
+        db.add(config)
+        
+        # Create cart
+        cart = models.Cart(user_id=new_user.id)
+        db.add(cart)
+        db.commit()
+        
+        return schemas.User.model_validate(new_user)
+
+    return await db.run(create_user)
 
 @app.post("/login")
-def login(user: schemas.UserLogin, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if not db_user or not auth.verify_password(user.password, db_user.hashed_password):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+async def login(user: schemas.UserLogin, db: database.AsyncDB = Depends(database.get_async_db)):
+    def find_user(db: Session):
+        return db.query(
+            models.User.id, models.User.email, models.User.hashed_password
+        ).filter(models.User.email == user.email).first()
+
+    db_user = await db.run(find_user)
+    try:
+        if not db_user or not await password_hasher.verify(user.password, db_user.hashed_password):
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        if needs_rehash(db_user.hashed_password):
+            # Cost factor changed since this hash was made: upgrade it now that we know the password
+            new_hash = await password_hasher.hash(user.password)
+
+            def store_hash(db: Session):
+                db.query(models.User).filter(models.User.id == db_user.id).update(
+                    {models.User.hashed_password: new_hash}, synchronize_session=False
+                )
+                db.commit()
+
+            await db.run(store_hash)
+    except HashingPoolSaturated:
+        raise hashing_busy()
     access_token = auth.create_access_token(data={"sub": db_user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
+def product_query(db: Session):
+    # Load variations and images in bulk instead of one lazy query per product
+    return db.query(models.Product).options(
+        selectinload(models.Product.variations),
+        selectinload(models.Product.images)
+    )
+
+# Lower bounds of the price facet buckets, in CLP
+PRICE_BUCKETS = [0, 10000, 25000, 50000]
+
+def get_product_filters(
+    category: Optional[str] = None,
+    min_price: Optional[int] = Query(None, ge=0),
+    max_price: Optional[int] = Query(None, ge=0),
+    variation_type: Optional[str] = None,
+    in_stock: bool = False
+):
+    return schemas.ProductFilters(
+        category=category,
+        min_price=min_price,
+        max_price=max_price,
+        variation_type=variation_type,
+        in_stock=in_stock
+    )
+
+def filter_products(query, filters: schemas.ProductFilters, include_category: bool = True):
+    query = query.filter(models.Product.is_active == True)
+    if include_category and filters.category:
+        query = query.filter(models.Product.category == filters.category)
+    if filters.min_price is not None:
+        query = query.filter(models.Product.price >= filters.min_price)
+    if filters.max_price is not None:
+        query = query.filter(models.Product.price <= filters.max_price)
+    if filters.variation_type:
+        query = query.filter(models.Product.variations.any(
+            models.ProductVariation.variation_type == filters.variation_type
+        ))
+    if filters.in_stock:
+        query = query.filter(or_(
+            models.Product.stock > 0,
+            models.Product.variations.any(models.ProductVariation.stock > 0)
+        ))
+    return query
+
+product_adapter = TypeAdapter(schemas.Product)
+product_list_adapter = TypeAdapter(List[schemas.Product])
+
+async def catalog_response(key, if_none_match: Optional[str], db: database.AsyncDB, render,
+                           accept_encoding: Optional[str] = None):
+    # Serve catalog reads from pre-serialized (and pre-compressed) bytes, keyed
+    # by the catalog version
+    entry = catalog_cache.get(key)
+    if entry is None:
+        version = catalog_cache.version
+        body, headers = await db.run(render)
+        entry = catalog_cache.set(key, body, headers, version=version)
+
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    encoding = compression.negotiate(accept_encoding) if len(entry.body) >= compression.COMPRESSION_MIN_SIZE else None
+    if encoding:
+        # Same entity in another coding, so the validator becomes weak
+        headers.update({"ETag": "W/" + entry.etag, "Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+        return Response(content=entry.encoded(encoding), media_type="application/json", headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
 @app.get("/products", response_model=List[schemas.Product])
-def get_products(db: Session = Depends(database.get_db)):
-    return db.query(models.Product).filter(models.Product.is_active == True).all()
+async def get_products(
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    after: Optional[int] = None,
+    fields: Optional[str] = Query(None, max_length=300),
+    filters: schemas.ProductFilters = Depends(get_product_filters),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    selected = product_fields.parse(fields)
+
+    def render(db: Session):
+        base = product_query(db) if selected is None else db.query(*product_fields.columns(selected))
+        query = filter_products(base, filters)
+        if after is not None:
+            query = query.filter(models.Product.id > after)
+        query = query.order_by(models.Product.id)
+        headers = {}
+        if limit is None:
+            products = query.all()
+        else:
+            # Keyset pagination: fetch one extra row to know if there is a next page
+            products = query.limit(limit + 1).all()
+            if len(products) > limit:
+                products = products[:limit]
+                headers["X-Next-Cursor"] = str(products[-1].id)
+        if selected is not None:
+            return product_fields.dump(db, products, selected), headers
+        items = product_list_adapter.validate_python(products, from_attributes=True)
+        return product_list_adapter.dump_json(items), headers
+
+    key = ("products", limit, after, selected, tuple(filters.model_dump().items()))
+    return await catalog_response(key, if_none_match, db, render, accept_encoding)
+
+@app.get("/products/facets", response_model=schemas.ProductFacets)
+async def get_product_facets(
+    filters: schemas.ProductFilters = Depends(get_product_filters),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    def render(db: Session):
+        # One grouped query for both facets. The category filter is left out so
+        # the sidebar keeps showing the other categories' counts.
+        bucket = case(
+            *[(models.Product.price >= low, i) for i, low in reversed(list(enumerate(PRICE_BUCKETS)))],
+            else_=0
+        ).label("bucket")
+        rows = filter_products(
+            db.query(models.Product.category, bucket, func.count(models.Product.id)),
+            filters,
+            include_category=False
+        ).group_by(models.Product.category, "bucket").all()
+
+        category_counts = {}
+        bucket_counts = [0] * len(PRICE_BUCKETS)
+        for category, bucket_index, count in rows:
+            category_counts[category] = category_counts.get(category, 0) + count
+            if not filters.category or category == filters.category:
+                bucket_counts[bucket_index] += count
+
+        facets = schemas.ProductFacets(
+            total=sum(bucket_counts),
+            categories=[
+                schemas.CategoryFacet(category=category, count=count)
+                for category, count in sorted(category_counts.items(), key=lambda item: str(item[0]))
+                if category is not None
+            ],
+            price_buckets=[
+                schemas.PriceBucketFacet(
+                    min_price=low,
+                    max_price=PRICE_BUCKETS[i + 1] - 1 if i + 1 < len(PRICE_BUCKETS) else None,
+                    count=bucket_counts[i]
+                )
+                for i, low in enumerate(PRICE_BUCKETS)
+            ]
+        )
+        return facets.model_dump_json().encode(), {}
+
+    return await catalog_response(("facets", tuple(filters.model_dump().items())), if_none_match, db, render, accept_encoding)
+
+@app.get("/products/search", response_model=List[schemas.Product])
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    fields: Optional[str] = Query(None, max_length=300),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    selected = product_fields.parse(fields)
+
+    def render(db: Session):
+        ids = search.search_product_ids(db, q, limit)
+        base = product_query(db) if selected is None else db.query(*product_fields.columns(selected))
+        by_id = {p.id: p for p in base.filter(models.Product.id.in_(ids))} if ids else {}
+        products = [by_id[product_id] for product_id in ids if product_id in by_id]
+        if selected is not None:
+            return product_fields.dump(db, products, selected), {}
+        items = product_list_adapter.validate_python(products, from_attributes=True)
+        return product_list_adapter.dump_json(items), {}
+
+    return await catalog_response(("search", q.strip().lower(), limit, selected), if_none_match, db, render, accept_encoding)
 
 @app.get("/products/{product_id}", response_model=schemas.Product)
-def get_product(product_id: int, db: Session = Depends(database.get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
+async def get_product(
+    product_id: int,
+    fields: Optional[str] = Query(None, max_length=300),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: database.AsyncDB = Depends(database.get_async_db)
+):
+    selected = product_fields.parse(fields)
+
+    def render(db: Session):
+        base = product_query(db) if selected is None else db.query(*product_fields.columns(selected))
+        product = base.filter(models.Product.id == product_id).first()
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if selected is not None:
+            return product_fields.dump_one(db, product, selected), {}
+        return product_adapter.dump_json(product_adapter.validate_python(product, from_attributes=True)), {}
+
+    return await catalog_response(("product", product_id, selected), if_none_match, db, render, accept_encoding)
+
+async def replay_checkout(db: database.AsyncDB, key: str, state):
+    # Same Idempotency-Key as an earlier request: hand back its response, waiting
+    # for it to finish if it is still in flight, without calling Transbank again
+    deadline = time.monotonic() + idempotency.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        if state is None:
+            raise HTTPException(status_code=409, detail="The original request failed, retry with the same key")
+        status_value, response_body = state
+        if status_value == "completed":
+            return json.loads(response_body)
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "1"}
+            )
+        await asyncio.sleep(0.2)
+        state = await db.run(idempotency.key_state, key)
 
 @app.post("/checkout")
-def checkout(
+async def checkout(
     order_data: schemas.OrderCreate, 
-    db: Session = Depends(database.get_db),
-    current_user: Optional[models.User] = Depends(auth.get_optional_current_user)
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: Optional[schemas.AuthenticatedUser] = Depends(auth.get_optional_current_user),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
-    try:
-        buy_order = str(uuid.uuid4())[:26]
-        session_id = str(uuid.uuid4())[:26]
-        
-        # Standard Webpay Plus
-        return_url = "http://localhost:3000/checkout/result"
-        print(f"Starting Webpay Plus for amount: {order_data.total_amount}")
-        response = TransbankService.start_webpay_plus(buy_order, session_id, order_data.total_amount, return_url)
-        print(f"Webpay response: {response}")
-        
+    if idempotency_key:
+        fingerprint = idempotency.request_fingerprint(
+            order_data.model_dump(), current_user.id if current_user else None
+        )
+        try:
+            existing = await db.run(idempotency.claim_key, idempotency_key, fingerprint)
+        except idempotency.IdempotencyConflict as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if existing is not None:
+            return await replay_checkout(db, idempotency_key, existing)
+
+    buy_order = str(uuid.uuid4())[:26]
+    session_id = str(uuid.uuid4())[:26]
+    user_id = current_user.id if current_user else None
+
+    def create_order(db: Session):
+        # The order and its stock reservations commit before Transbank is called,
+        # so no row lock or connection is held during the round trip
+        lines = stock.order_lines(db, user_id, order_data.items)
+        if not lines:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        try:
+            priced = pricing.price_lines(db, lines, pricing.discount_index.lookup(db, order_data.discount_code))
+        except pricing.PricingError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if order_data.total_amount is not None and order_data.total_amount != priced.total:
+            checkout_logger.info("Client total %s differs from priced total %s", order_data.total_amount, priced.total)
         new_order = models.Order(
-            total_amount=order_data.total_amount,
+            total_amount=priced.total,
             buy_order=buy_order,
             session_id=session_id,
-            token_ws=response['token'],
             payment_type="webpay_plus",
-            user_id=current_user.id if current_user else None,
+            user_id=user_id,
             guest_email=order_data.guest_email if not current_user else None,
             guest_address=order_data.guest_address if not current_user else None
         )
         db.add(new_order)
+        db.flush()
+        try:
+            stock.reserve_stock(db, new_order.id, lines)
+        except stock.OutOfStock:
+            db.rollback()
+            raise
         db.commit()
-        print(f"Order created with ID: {new_order.id}")
-        
-        return {"url": response['url'], "token": response['token']}
+        return new_order.id, priced.total
+
+    def attach_token(db: Session, order_id: int, result):
+        db.query(models.Order).filter(models.Order.id == order_id).update(
+            {models.Order.token_ws: result["token"]}, synchronize_session=False
+        )
+        if idempotency_key:
+            idempotency.complete_key(db, idempotency_key, result, order_id)
+        db.commit()
+
+    def abandon_order(db: Session, order_id: int):
+        db.rollback()
+        stock.release_order(db, order_id)
+        db.query(models.Order).filter(models.Order.id == order_id).update(
+            {models.Order.status: "failed"}, synchronize_session=False
+        )
+        db.commit()
+
+    async def abandon(order_id):
+        if order_id is not None:
+            await db.run(abandon_order, order_id)
+        if idempotency_key:
+            await db.run(idempotency.release_key, idempotency_key)
+
+    order_id = None
+    try:
+        order_id, total_amount = await db.run(create_order)
+        checkout_logger.info("Order %s created, starting Webpay Plus for %s", order_id, total_amount)
+
+        # Standard Webpay Plus
+        return_url = "http://localhost:3000/checkout/result"
+        response = await payment_gateway.start_webpay_plus(buy_order, session_id, total_amount, return_url)
+        checkout_logger.info("Webpay transaction started for order %s", order_id)
+        result = {"url": response['url'], "token": response['token']}
+
+        await db.run(attach_token, order_id, result)
+        return result
+    except stock.OutOfStock as e:
+        await abandon(None)
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        await abandon(order_id)
+        raise
+    except PaymentGatewayUnavailable as e:
+        await abandon(order_id)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
-        print(f"Checkout error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        checkout_logger.exception("Checkout failed for order %s", order_id)
+        await abandon(order_id)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/checkout/quote", response_model=schemas.CartPricing)
+async def quote_checkout(
+    quote: schemas.PricingRequest,
+    db: database.AsyncDB = Depends(database.get_async_db),
+    current_user: Optional[schemas.AuthenticatedUser] = Depends(auth.get_optional_current_user)
+):
+    # The amount /checkout will charge for the same lines and code
+    def price(db: Session):
+        try:
+            if quote.items is None and current_user:
+                return pricing.quote_saved_cart(db, current_user.id, quote.discount_code)
+            discount = pricing.discount_index.lookup(db, quote.discount_code)
+            return pricing.price_lines(db, stock.order_lines(db, None, quote.items or []), discount)
+        except pricing.PricingError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await db.run(price)
+
 @app.get("/checkout/confirm")
-def confirm_payment(token_ws: str, db: Session = Depends(database.get_db)):
-    response = TransbankService.commit_webpay_plus(token_ws)
-    
-    order = db.query(models.Order).filter(models.Order.token_ws == token_ws).first()
-    if order:
-        if response['status'] == 'AUTHORIZED':
-            order.status = "paid"
-        else:
-            order.status = "failed"
-        db.commit()
+async def confirm_payment(token_ws: str, db: database.AsyncDB = Depends(database.get_async_db)):
+    try:
+        response = await payment_gateway.commit_webpay_plus(token_ws)
+    except PaymentGatewayUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     
+    def update_order(db: Session):
+        order = db.query(models.Order).filter(models.Order.token_ws == token_ws).first()
+        if order:
+            if response['status'] == 'AUTHORIZED':
+                order.status = "paid"
+                stock.commit_order(db, order.id)
+                stats.record_payment(db, order.id, order.total_amount)
+            else:
+                order.status = "failed"
+                stats.reverse_payment(db, order.id, order.total_amount)
+                stock.release_order(db, order.id)
+            db.commit()
+
+    await db.run(update_order)
     return response
 
 # --- New Endpoints for Account Management ---
 
 @app.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
-    return current_user
+def read_users_me(
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    user = db.query(models.User).options(
+        selectinload(models.User.configuration),
+        selectinload(models.User.addresses),
+        selectinload(models.User.orders),
+        selectinload(models.User.support_tickets)
+    ).filter(models.User.id == current_user.id).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 @app.put("/users/me/configuration", response_model=schemas.UserConfiguration)
 def update_user_configuration(
     config_in: schemas.UserConfigurationBase,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     config = db.query(models.UserConfiguration).filter(models.UserConfiguration.user_id == current_user.id).first()
@@ -302,7 +740,7 @@ def update_user_configuration(
 @app.post("/users/me/addresses", response_model=schemas.UserAddress)
 def create_user_address(
     address_in: schemas.UserAddressCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     address = models.UserAddress(user_id=current_user.id, **address_in.dict())
@@ -311,126 +749,309 @@ def create_user_address(
     db.refresh(address)
     return address
 
+def get_order_filters(
+    status: Optional[str] = None,
+    created_from: Optional[datetime.datetime] = None,
+    created_to: Optional[datetime.datetime] = None,
+    user_id: Optional[int] = None,
+    guest_email: Optional[str] = None
+):
+    return schemas.OrderFilters(
+        status=status,
+        created_from=created_from,
+        created_to=created_to,
+        user_id=user_id,
+        guest_email=guest_email
+    )
+
+def filter_orders(query, filters: schemas.OrderFilters):
+    if filters.status:
+        query = query.filter(models.Order.status == filters.status)
+    if filters.created_from is not None:
+        query = query.filter(models.Order.created_at >= filters.created_from)
+    if filters.created_to is not None:
+        query = query.filter(models.Order.created_at < filters.created_to)
+    if filters.user_id is not None:
+        query = query.filter(models.Order.user_id == filters.user_id)
+    if filters.guest_email:
+        query = query.filter(func.lower(models.Order.guest_email) == filters.guest_email.lower())
+    return query
+
+def order_cursor(order):
+    return f"{order.created_at.isoformat()}_{order.id}"
+
+def parse_order_cursor(cursor: str):
+    try:
+        created_at, order_id = cursor.rsplit("_", 1)
+        return datetime.datetime.fromisoformat(created_at), int(order_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+order_list_adapter = TypeAdapter(List[schemas.Order])
+
+def order_page(db: Session, filters: schemas.OrderFilters, limit: int, after: Optional[str],
+               fields: Optional[tuple] = None):
+    # Keyset pagination on (created_at, id), newest first. The total is the
+    # planner's estimate on large results instead of a COUNT(*).
+    if fields is None:
+        query = db.query(models.Order)
+    else:
+        # The cursor columns are always selected, even when not returned
+        query = db.query(*order_fields.columns(fields, extra=("created_at", "id")))
+    query = filter_orders(query, filters)
+    total = stats.estimated_query_count(db, query)
+    if after:
+        query = query.filter(tuple_(models.Order.created_at, models.Order.id) < parse_order_cursor(after))
+    orders = query.order_by(models.Order.created_at.desc(), models.Order.id.desc()).limit(limit + 1).all()
+    headers = {"X-Estimated-Total": str(total)}
+    if len(orders) > limit:
+        orders = orders[:limit]
+        headers["X-Next-Cursor"] = order_cursor(orders[-1])
+    if fields is not None:
+        return Response(content=order_fields.dump(db, orders, fields), media_type="application/json", headers=headers)
+    return trusted_json(order_list_adapter, orders, headers)
+
 @app.get("/users/me/orders", response_model=List[schemas.Order])
-def get_user_orders(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+async def get_user_orders(
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    fields: Optional[str] = Query(None, max_length=300),
+    filters: schemas.OrderFilters = Depends(get_order_filters),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: database.AsyncDB = Depends(database.get_async_db)
 ):
-    return db.query(models.Order).filter(models.Order.user_id == current_user.id).all()
+    filters = filters.model_copy(update={"user_id": current_user.id, "guest_email": None})
+    return await db.run(order_page, filters, limit, after, order_fields.parse(fields))
 
-def check_admin(current_user: models.User = Depends(auth.get_current_user)):
+async def check_admin(current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return current_user
 
 # Admin: Manage Products
 @app.get("/orders", response_model=List[schemas.Order])
-def get_all_orders(
-    db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+async def get_all_orders(
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    fields: Optional[str] = Query(None, max_length=300),
+    filters: schemas.OrderFilters = Depends(get_order_filters),
+    db: database.AsyncDB = Depends(database.get_async_db),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
-    return db.query(models.Order).order_by(models.Order.created_at.desc()).all()
+    return await db.run(order_page, filters, limit, after, order_fields.parse(fields))
 
 @app.put("/orders/{order_id}/status", response_model=schemas.Order)
-def update_order_status(
+async def update_order_status(
     order_id: int,
     status_update: schemas.OrderStatusUpdate,
-    db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    db: database.AsyncDB = Depends(database.get_async_db),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    order.status = status_update.status
-    db.commit()
-    db.refresh(order)
-    return order
+    def set_status(db: Session):
+        order = db.query(models.Order).filter(models.Order.id == order_id).first()
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        order.status = status_update.status
+        if order.status in stats.SOLD_STATUSES:
+            # Paid outside Webpay: keep the stock and count the sale once,
+            # like a confirmed payment
+            stock.commit_order(db, order.id)
+            stats.record_payment(db, order.id, order.total_amount)
+        else:
+            # Moved out of a sold status: the sale no longer counts
+            stats.reverse_payment(db, order.id, order.total_amount)
+            if order.status == "failed":
+                stock.release_order(db, order.id)
+        db.commit()
+        db.refresh(order)
+        return schemas.Order.model_validate(order)
+
+    return await db.run(set_status)
+
+@app.get("/stats/pricing-cache")
+def get_pricing_cache_stats(admin: schemas.AuthenticatedUser = Depends(check_admin)):
+    return pricing.pricing_cache.stats()
+
+@app.get("/stats/user-cache")
+def get_user_cache_stats(admin: schemas.AuthenticatedUser = Depends(check_admin)):
+    return user_cache.stats()
+
+@app.get("/stats/db-pool")
+def get_db_pool_stats(admin: schemas.AuthenticatedUser = Depends(check_admin)):
+    return FastJSONResponse({
+        "pools": {name: metrics.snapshot() for name, metrics in pool_metrics.items()},
+        "sessions": session_leaks.snapshot()
+    })
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics(authorization: Optional[str] = Header(None)):
+    # Prometheus scrape endpoint; set METRICS_TOKEN to keep it private
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/stats/summary")
 def get_stats_summary(
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
-):
-    total_sales = db.query(models.Order).filter(models.Order.status == "paid").sum(models.Order.total_amount) or 0
-    # Wait, sqlalchemy sum usage might be different
-    from sqlalchemy import func
-    total_sales = db.query(func.sum(models.Order.total_amount)).filter(models.Order.status == "paid").scalar() or 0
-    order_count = db.query(models.Order).count()
-    product_count = db.query(models.Product).count()
-    user_count = db.query(models.User).count()
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    # Sales come from the daily rollups and row counts from estimates, so this
+    # stays cheap however large the tables get
+    total_sales = db.query(func.sum(models.SalesRollup.sales_total)).filter(
+        models.SalesRollup.period == "day"
+    ).scalar() or 0
     
-    return {
+    return FastJSONResponse({
         "total_sales": total_sales,
-        "order_count": order_count,
-        "product_count": product_count,
-        "user_count": user_count
-    }
+        "order_count": stats.estimated_count(db, models.Order),
+        "product_count": stats.estimated_count(db, models.Product),
+        "user_count": stats.estimated_count(db, models.User)
+    })
+
+TIMESERIES_MAX_POINTS = 2000
+
+@app.get("/stats/timeseries", response_model=schemas.SalesTimeseries)
+def get_stats_timeseries(
+    period: str = Query("day", pattern="^(hour|day)$"),
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    db: Session = Depends(database.get_db),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    end = end or datetime.datetime.utcnow()
+    start = start or end - (datetime.timedelta(hours=47) if period == "hour" else datetime.timedelta(days=29))
+    step = datetime.timedelta(hours=1) if period == "hour" else datetime.timedelta(days=1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start) / step > TIMESERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {TIMESERIES_MAX_POINTS} buckets per request")
+    return stats.sales_timeseries(db, period, start, end)
 
 @app.post("/products", response_model=schemas.Product)
 def create_product(
     product: schemas.ProductCreate,
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
     product_data = product.dict()
     variations_data = product_data.pop("variations", [])
     images_data = product_data.pop("images", [])
-    db_product = models.Product(**product_data)
+    if product_data["sku"] and db.query(models.Product.id).filter(models.Product.sku == product_data["sku"]).first():
+        raise HTTPException(status_code=409, detail="A product with this SKU already exists")
+
+    # Product, variations and images go in with a single commit
+    db_product = models.Product(
+        **product_data,
+        variations=[models.ProductVariation(**var_data) for var_data in variations_data],
+        images=[models.ProductImage(**img_data) for img_data in images_data]
+    )
     db.add(db_product)
     db.commit()
-    db.refresh(db_product)
-    
-    for var_data in variations_data:
-        db_var = models.ProductVariation(**var_data, product_id=db_product.id)
-        db.add(db_var)
-    
-    for img_data in images_data:
-        db_img = models.ProductImage(**img_data, product_id=db_product.id)
-        db.add(db_img)
-    
-    db.commit()
+    catalog_cache.bump()
     db.refresh(db_product)
     return db_product
 
-@app.put("/products/{product_id}", response_model=schemas.Product)
-def update_product(
-    product_id: int,
-    product: schemas.ProductCreate,
+@app.post("/products/import")
+def import_products(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|json|ndjson)$"),
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    # Upserts by SKU in chunks; rows that fail validation or insertion are
+    # reported by row number and don't stop the rest of the file
+    fmt = product_import.detect_format(file.filename, format)
+    report = product_import.run_import(db, file.file, fmt, progress=product_import.log_progress)
+    if report.created or report.updated:
+        catalog_cache.bump()
+    return FastJSONResponse(report.as_dict())
+
+def load_product_for_update(db: Session, product_id: int):
+    db_product = db.query(models.Product).options(
+        selectinload(models.Product.variations), selectinload(models.Product.images)
+    ).filter(models.Product.id == product_id).first()
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    product_data = product.dict()
-    variations_data = product_data.pop("variations", [])
-    images_data = product_data.pop("images", [])
-    
-    for key, value in product_data.items():
-        setattr(db_product, key, value)
-    
-    # Update variations
-    db.query(models.ProductVariation).filter(models.ProductVariation.product_id == product_id).delete()
-    for var_data in variations_data:
-        db_var = models.ProductVariation(**var_data, product_id=product_id)
-        db.add(db_var)
-    
-    # Update images
-    db.query(models.ProductImage).filter(models.ProductImage.product_id == product_id).delete()
-    for img_data in images_data:
-        db_img = models.ProductImage(**img_data, product_id=product_id)
-        db.add(db_img)
-    
-    db.commit()
-    db.refresh(db_product)
     return db_product
 
+def apply_product_changes(db: Session, db_product, fields: dict, variations=None, replace_variations=True,
+                          removed_variation_ids=(), images=None):
+    # Diffs against the stored rows: unchanged variations and images are left
+    # alone, so their ids (which carts and reservations point at) stay stable
+    if fields.get("sku") and fields["sku"] != db_product.sku and db.query(models.Product.id).filter(
+        models.Product.sku == fields["sku"], models.Product.id != db_product.id
+    ).first():
+        raise HTTPException(status_code=409, detail="A product with this SKU already exists")
+    try:
+        changed = product_updates.apply_fields(db_product, fields)
+        if variations is not None:
+            changed |= product_updates.sync_variations(db, db_product, variations, replace_variations)
+        if removed_variation_ids:
+            known = {v.id for v in db_product.variations} & set(removed_variation_ids)
+            if known:
+                product_updates.delete_variations(db, db_product, known)
+                changed = True
+        if images is not None:
+            changed |= product_updates.sync_images(db_product, images)
+    except product_updates.VariationInUse as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except product_updates.ProductUpdateError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    if changed:
+        db.commit()
+        catalog_cache.bump()
+        db.refresh(db_product)
+    return db_product
+
+@app.put("/products/{product_id}", response_model=schemas.Product)
+def update_product(
+    product_id: int,
+    product: schemas.ProductUpdate,
+    db: Session = Depends(database.get_db),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    # Optional fields the client left out (sku, stock, is_active, variations,
+    # images) keep their stored values instead of being reset to defaults
+    db_product = load_product_for_update(db, product_id)
+    sent = product.model_fields_set
+    return apply_product_changes(
+        db, db_product,
+        product.model_dump(exclude_unset=True, exclude={"variations", "images"}),
+        variations=[v.model_dump() for v in product.variations] if "variations" in sent else None,
+        images=[i.model_dump() for i in product.images] if "images" in sent else None
+    )
+
+@app.patch("/products/{product_id}", response_model=schemas.Product)
+def patch_product(
+    product_id: int,
+    product: schemas.ProductPatch,
+    db: Session = Depends(database.get_db),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    # Partial update: only the fields sent are written, e.g.
+    # {"variations": [{"id": 12, "stock": 30}]} updates a single row
+    db_product = load_product_for_update(db, product_id)
+    fields = product.model_dump(exclude_unset=True, exclude={"variations", "removed_variation_ids", "images"})
+    return apply_product_changes(
+        db, db_product,
+        {key: value for key, value in fields.items() if value is not None or key == "sku"},
+        variations=[
+            {key: value for key, value in v.model_dump(exclude_unset=True).items()
+             if value is not None or key in ("variation_type", "price")}
+            for v in product.variations
+        ] if product.variations is not None else None,
+        replace_variations=False,
+        removed_variation_ids=product.removed_variation_ids,
+        images=[i.model_dump() for i in product.images] if product.images is not None else None
+    )
+
 @app.delete("/products/{product_id}")
 def delete_product(
     product_id: int,
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
     db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
     if not db_product:
@@ -438,25 +1059,66 @@ def delete_product(
     
     db.delete(db_product)
     db.commit()
+    catalog_cache.bump()
     return {"message": "Product deleted"}
 
+# Product images: originals on local disk, resized variants rendered on demand
+PUBLIC_API_URL = os.getenv("PUBLIC_API_URL")
+IMAGE_DIGEST = "^[0-9a-f]{32}$"
+
+@app.post("/images")
+async def upload_image(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    data = await file.read(imaging.IMAGE_MAX_UPLOAD_BYTES + 1)
+    try:
+        digest, extension = await run_in_threadpool(imaging.store_original, data)
+    except imaging.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The usual catalog sizes are ready before the storefront asks for them
+    background_tasks.add_task(image_pipeline.pregenerate, digest)
+    return imaging.image_urls(PUBLIC_API_URL or str(request.base_url), digest, extension)
+
+@app.get("/images/{digest}.{extension}")
+def get_original_image(digest: str = Path(..., pattern=IMAGE_DIGEST), extension: str = Path(...)):
+    path = imaging.original_path(digest, extension)
+    if extension not in imaging.MEDIA_TYPES or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type=imaging.MEDIA_TYPES[extension], headers={"Cache-Control": imaging.IMMUTABLE})
+
+@app.get("/images/{digest}/{width}.{fmt}")
+async def get_image_variant(digest: str = Path(..., pattern=IMAGE_DIGEST), width: int = Path(...), fmt: str = Path(...)):
+    if width not in imaging.IMAGE_WIDTHS or fmt not in imaging.VARIANT_FORMATS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        path = await image_pipeline.variant(digest, width, fmt)
+    except imaging.ImagePoolSaturated:
+        raise HTTPException(status_code=503, detail="Image service busy, try again", headers={"Retry-After": "1"})
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type=imaging.VARIANT_FORMATS[fmt][1], headers={"Cache-Control": imaging.IMMUTABLE})
+
 # Admin: Discounts
 @app.post("/discounts", response_model=schemas.Discount)
 def create_discount(
     discount: schemas.DiscountCreate,
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
     db_discount = models.Discount(**discount.dict())
     db.add(db_discount)
     db.commit()
     db.refresh(db_discount)
+    pricing.discount_index.invalidate()
     return db_discount
 
 @app.get("/discounts", response_model=List[schemas.Discount])
 def get_discounts(
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
     return db.query(models.Discount).all()
 
@@ -464,7 +1126,7 @@ def get_discounts(
 @app.post("/support", response_model=schemas.SupportTicket)
 def create_ticket(
     ticket: schemas.SupportTicketCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     db_ticket = models.SupportTicket(**ticket.dict(), user_id=current_user.id)
@@ -475,7 +1137,7 @@ def create_ticket(
 
 @app.get("/support/me", response_model=List[schemas.SupportTicket])
 def get_my_tickets(
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     return db.query(models.SupportTicket).filter(models.SupportTicket.user_id == current_user.id).all()
@@ -483,7 +1145,60 @@ def get_my_tickets(
 @app.get("/support/admin", response_model=List[schemas.SupportTicket])
 def get_all_tickets(
     db: Session = Depends(database.get_db),
-    admin: models.User = Depends(check_admin)
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
 ):
     return db.query(models.SupportTicket).all()
 
+
+# --- Admin exports (streamed, constant memory) ---
+
+EXPORT_FORMAT = Query("csv", pattern="^(csv|ndjson)$")
+
+@app.get("/export/orders")
+def export_orders(
+    format: str = EXPORT_FORMAT,
+    filters: schemas.OrderFilters = Depends(get_order_filters),
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    stmt = select(
+        models.Order.id, models.Order.created_at, models.Order.paid_at, models.Order.status,
+        models.Order.total_amount, models.Order.buy_order, models.Order.payment_type, models.Order.user_id,
+        models.User.email.label("user_email"), models.Order.guest_email, models.Order.guest_address
+    ).outerjoin(models.User, models.User.id == models.Order.user_id)
+    stmt = filter_orders(stmt, filters).order_by(models.Order.id)
+    return exports.export_response(stmt, format, "orders")
+
+@app.get("/export/customers")
+def export_customers(
+    format: str = EXPORT_FORMAT,
+    is_active: Optional[bool] = None,
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    stmt = select(
+        models.User.id, models.User.email, models.User.first_name, models.User.last_name,
+        models.User.cat_name, models.User.cat_breed, models.User.is_active, models.User.is_admin
+    )
+    if is_active is not None:
+        stmt = stmt.where(models.User.is_active == is_active)
+    return exports.export_response(stmt.order_by(models.User.id), format, "customers")
+
+@app.get("/export/support-tickets")
+def export_support_tickets(
+    format: str = EXPORT_FORMAT,
+    status: Optional[str] = None,
+    created_from: Optional[datetime.datetime] = None,
+    created_to: Optional[datetime.datetime] = None,
+    admin: schemas.AuthenticatedUser = Depends(check_admin)
+):
+    stmt = select(
+        models.SupportTicket.id, models.SupportTicket.created_at, models.SupportTicket.status,
+        models.SupportTicket.user_id, models.User.email.label("user_email"),
+        models.SupportTicket.subject, models.SupportTicket.message
+    ).outerjoin(models.User, models.User.id == models.SupportTicket.user_id)
+    if status:
+        stmt = stmt.where(models.SupportTicket.status == status)
+    if created_from is not None:
+        stmt = stmt.where(models.SupportTicket.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(models.SupportTicket.created_at < created_to)
+    return exports.export_response(stmt.order_by(models.SupportTicket.id), format, "support_tickets")
@@ -0,0 +1,231 @@
+import datetime
+import logging
+import os
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+from sqlalchemy.schema import CreateIndex
+
+import models
+from search import SEARCH_INDEX_DDL
+
+logger = logging.getLogger("miauhome.migrations")
+
+# Apply pending revisions when the API boots. Turn it off to run
+# "python migrations.py upgrade" as a deploy step instead.
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "1").lower() in ("1", "true", "yes")
+# Key for pg_advisory_xact_lock, shared by every worker and the CLI
+MIGRATION_LOCK_ID = 72641001
+
+# Kept out of models.Base so create_all never touches it
+version_table = Table(
+    "schema_migrations", MetaData(),
+    Column("version", String, primary_key=True),
+    Column("applied_at", DateTime),
+)
+
+
+def add_columns(connection, columns):
+    inspector = inspect(connection)
+    existing = {}
+    for table, column, type_def in columns:
+        if table not in existing:
+            existing[table] = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing[table]:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {type_def}"))
+            existing[table].add(column)
+
+
+# Revisions run in list order and each one is recorded once applied. The
+# baseline creates missing tables straight from the models, so later revisions
+# must tolerate finding their change already there (see add_columns).
+
+def baseline(connection):
+    models.Base.metadata.create_all(bind=connection)
+
+
+def legacy_columns(connection):
+    # user_payment_methods has no model; it was only ever created by hand
+    primary_key = "SERIAL PRIMARY KEY" if connection.dialect.name == "postgresql" else "INTEGER PRIMARY KEY"
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS user_payment_methods (
+            id {primary_key},
+            user_id INTEGER REFERENCES users(id),
+            card_type VARCHAR,
+            last_four VARCHAR,
+            exp_month INTEGER,
+            exp_year INTEGER,
+            is_default BOOLEAN DEFAULT FALSE
+        )
+    """))
+    # Columns added to databases created before they existed on the models
+    add_columns(connection, [
+        ("users", "first_name", "VARCHAR"),
+        ("users", "last_name", "VARCHAR"),
+        ("users", "cat_name", "VARCHAR"),
+        ("users", "cat_breed", "VARCHAR"),
+        ("users", "is_admin", "BOOLEAN DEFAULT FALSE"),
+        ("products", "stock", "INTEGER DEFAULT 0"),
+        ("products", "is_active", "BOOLEAN DEFAULT TRUE"),
+        ("products", "sku", "VARCHAR"),
+        ("product_variations", "variation_type", "VARCHAR"),
+        ("cart_items", "variation_id", "INTEGER REFERENCES product_variations(id)"),
+        ("carts", "version", "INTEGER NOT NULL DEFAULT 0"),
+        ("user_payment_methods", "tbk_user", "VARCHAR"),
+        ("user_payment_methods", "username", "VARCHAR"),
+        ("orders", "tbk_token", "VARCHAR"),
+        ("orders", "payment_type", "VARCHAR DEFAULT 'webpay_plus'"),
+        ("orders", "guest_email", "VARCHAR"),
+        ("orders", "guest_address", "VARCHAR"),
+        ("orders", "paid_at", "TIMESTAMP"),
+    ])
+
+
+def merge_user_carts(connection):
+    # Duplicate carts per user would stop uq_carts_user_id from building. The
+    # lowest cart id is kept and takes over the others' lines, which
+    # merge_cart_lines then folds together.
+    if connection.dialect.name != "postgresql":
+        return
+    duplicates = """
+        SELECT user_id, min(id) AS keep_id
+        FROM carts
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+        HAVING count(*) > 1
+    """
+    connection.execute(text(f"""
+        UPDATE cart_items SET cart_id = d.keep_id
+        FROM carts c, ({duplicates}) d
+        WHERE cart_items.cart_id = c.id AND c.user_id = d.user_id AND c.id <> d.keep_id
+    """))
+    # Priced cart memos are keyed on the version
+    connection.execute(text(f"""
+        UPDATE carts SET version = carts.version + 1
+        FROM ({duplicates}) d
+        WHERE carts.id = d.keep_id
+    """))
+    connection.execute(text("""
+        DELETE FROM carts a USING carts b
+        WHERE a.user_id = b.user_id AND a.id > b.id
+    """))
+
+
+def merge_cart_lines(connection):
+    # Duplicate lines would stop the unique cart line indexes from building
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text("""
+        UPDATE cart_items SET quantity = d.total
+        FROM (
+            SELECT min(id) AS keep_id, sum(quantity) AS total
+            FROM cart_items
+            GROUP BY cart_id, product_id, variation_id
+            HAVING count(*) > 1
+        ) d
+        WHERE cart_items.id = d.keep_id
+    """))
+    connection.execute(text("""
+        DELETE FROM cart_items a USING cart_items b
+        WHERE a.id > b.id
+          AND a.cart_id = b.cart_id
+          AND a.product_id = b.product_id
+          AND a.variation_id IS NOT DISTINCT FROM b.variation_id
+    """))
+
+
+def model_indexes(connection):
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def order_created_at(connection):
+    # Old inserts left created_at empty. Order listings page on
+    # (created_at, id), so those rows sort as the oldest orders instead
+    connection.execute(
+        text("UPDATE orders SET created_at = :epoch WHERE created_at IS NULL"),
+        {"epoch": datetime.datetime(1970, 1, 1)}
+    )
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL"))
+
+
+def idempotency_lease(connection):
+    add_columns(connection, [("idempotency_keys", "locked_until", "TIMESTAMP")])
+
+
+def search_indexes(connection):
+    if connection.dialect.name == "postgresql":
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+
+
+REVISIONS = [
+    ("0001_baseline", baseline),
+    ("0002_legacy_columns", legacy_columns),
+    # Added after 0003 shipped; it must still run before the indexes in 0004
+    ("0003a_merge_user_carts", merge_user_carts),
+    ("0003_merge_cart_lines", merge_cart_lines),
+    ("0004_model_indexes", model_indexes),
+    ("0005_search_indexes", search_indexes),
+    ("0006_order_created_at", order_created_at),
+    ("0007_idempotency_lease", idempotency_lease),
+]
+
+
+def applied_versions(connection):
+    if not inspect(connection).has_table(version_table.name):
+        return set()
+    return set(connection.execute(select(version_table.c.version)).scalars())
+
+
+def pending(connection):
+    applied = applied_versions(connection)
+    return [(version, step) for version, step in REVISIONS if version not in applied]
+
+
+def upgrade(engine):
+    # Every pending revision runs in one transaction (DDL is transactional on
+    # Postgres). The advisory lock makes workers booting together take turns:
+    # the ones that waited find nothing left to apply.
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+        version_table.create(bind=connection, checkfirst=True)
+        steps = pending(connection)
+        for version, step in steps:
+            logger.info("Applying migration %s", version)
+            step(connection)
+            connection.execute(version_table.insert().values(
+                version=version, applied_at=datetime.datetime.utcnow()
+            ))
+    return [version for version, _ in steps]
+
+
+def ensure_current(engine):
+    # API startup: when the schema is current this costs a catalog lookup and
+    # one SELECT, with no lock and no DDL
+    with engine.connect() as connection:
+        if not pending(connection):
+            return []
+    if not DB_MIGRATE_ON_STARTUP:
+        raise RuntimeError("Database schema is out of date, run: python migrations.py upgrade")
+    return upgrade(engine)
+
+
+if __name__ == "__main__":
+    import sys
+    import database
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "status":
+        with database.engine.connect() as conn:
+            applied = applied_versions(conn)
+        for version, _ in REVISIONS:
+            print(f"{'applied' if version in applied else 'pending'}  {version}")
+    elif command == "upgrade":
+        applied = upgrade(database.engine)
+        print(f"Applied {len(applied)} migration(s)" + (": " + ", ".join(applied) if applied else ""))
+    else:
+        print("Usage: python migrations.py [upgrade|status]")
+        sys.exit(1)
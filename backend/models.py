@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index, func, text
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -43,6 +43,7 @@ class UserAddress(Base):
 class Product(Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True, index=True)
+    sku = Column(String, nullable=True) # supplier/external reference, used by bulk imports
     name = Column(String, index=True)
     description = Column(String)
     price = Column(Integer)
@@ -54,10 +55,21 @@ class Product(Base):
     images = relationship("ProductImage", back_populates="product", cascade="all, delete-orphan")
     variations = relationship("ProductVariation", back_populates="product", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("uq_products_sku", "sku", unique=True),
+        # Catalog listing and facets only ever look at active products
+        Index("ix_products_active_category_price", "category", "price",
+              postgresql_where=text("is_active"), sqlite_where=text("is_active")),
+        Index("ix_products_active_price", "price",
+              postgresql_where=text("is_active"), sqlite_where=text("is_active")),
+        Index("ix_products_in_stock", "category",
+              postgresql_where=text("is_active AND stock > 0"), sqlite_where=text("is_active AND stock > 0")),
+    )
+
 class ProductImage(Base):
     __tablename__ = "product_images"
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     url = Column(String)
 
     product = relationship("Product", back_populates="images")
@@ -73,6 +85,13 @@ class ProductVariation(Base):
 
     product = relationship("Product", back_populates="variations")
 
+    __table_args__ = (
+        Index("ix_product_variations_product_id", "product_id"),
+        Index("ix_product_variations_type_product", "variation_type", "product_id"),
+        Index("ix_product_variations_in_stock", "product_id",
+              postgresql_where=text("stock > 0"), sqlite_where=text("stock > 0")),
+    )
+
 class Discount(Base):
     __tablename__ = "discounts"
     id = Column(Integer, primary_key=True, index=True)
@@ -102,20 +121,91 @@ class Order(Base):
     session_id = Column(String)
     token_ws = Column(String, nullable=True) # For Webpay Plus
     payment_type = Column(String, default="webpay_plus")
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    paid_at = Column(DateTime, nullable=True) # set once, when the sale is added to the rollups
     guest_email = Column(String, nullable=True)
     guest_address = Column(String, nullable=True)
 
     user = relationship("User", back_populates="orders")
+    reservations = relationship("StockReservation", back_populates="order")
+
+    # Order listings page on (created_at, id), newest first
+    __table_args__ = (
+        Index("ix_orders_created_id", "created_at", "id"),
+        Index("ix_orders_status_created", "status", "created_at", "id"),
+        Index("ix_orders_user_created", "user_id", "created_at", "id"),
+    )
+
+# Guest email filter matches case-insensitively
+Index("ix_orders_guest_email_lower", func.lower(Order.guest_email))
+
+class StockReservation(Base):
+    __tablename__ = "stock_reservations"
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"))
+    variation_id = Column(Integer, ForeignKey("product_variations.id"), nullable=True)
+    quantity = Column(Integer)
+    status = Column(String, default="held") # held, committed, released, cancelled
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime)
+
+    order = relationship("Order", back_populates="reservations")
+
+    __table_args__ = (
+        # The sweeper only scans reservations that are still held
+        Index("ix_stock_reservations_held_expiry", "expires_at",
+              postgresql_where=text("status = 'held'"), sqlite_where=text("status = 'held'")),
+    )
+
+class SalesRollup(Base):
+    __tablename__ = "sales_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    period = Column(String) # hour, day
+    bucket_start = Column(DateTime)
+    order_count = Column(Integer, default=0)
+    sales_total = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("uq_sales_rollups_bucket", "period", "bucket_start", unique=True),
+    )
+
+class CategorySalesRollup(Base):
+    __tablename__ = "category_sales_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    bucket_start = Column(DateTime) # daily buckets
+    category = Column(String)
+    units = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("uq_category_sales_rollups_bucket", "bucket_start", "category", unique=True),
+    )
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True)
+    request_hash = Column(String)
+    status = Column(String, default="in_progress") # in_progress, completed
+    response_body = Column(String, nullable=True) # JSON returned to the client
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+    locked_until = Column(DateTime, nullable=True) # in_progress only: past this, a retry may take the key over
 
 class Cart(Base):
     __tablename__ = "carts"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    version = Column(Integer, default=0, nullable=False) # bumped on every change to the cart
 
     user = relationship("User", back_populates="cart")
-    items = relationship("CartItem", back_populates="cart")
+    items = relationship("CartItem", back_populates="cart", order_by="CartItem.id")
+
+    __table_args__ = (
+        Index("uq_carts_user_id", "user_id", unique=True),
+    )
 
 class CartItem(Base):
     __tablename__ = "cart_items"
@@ -128,3 +218,12 @@ class CartItem(Base):
     cart = relationship("Cart", back_populates="items")
     product = relationship("Product")
     variation = relationship("ProductVariation")
+
+    # One line per (cart, product, variation). NULLs never collide in a plain
+    # unique index, so lines without a variation get their own partial index.
+    __table_args__ = (
+        Index("uq_cart_items_line", "cart_id", "product_id", "variation_id", unique=True,
+              postgresql_where=text("variation_id IS NOT NULL"), sqlite_where=text("variation_id IS NOT NULL")),
+        Index("uq_cart_items_line_no_variation", "cart_id", "product_id", unique=True,
+              postgresql_where=text("variation_id IS NULL"), sqlite_where=text("variation_id IS NULL")),
+    )
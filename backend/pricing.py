@@ -0,0 +1,228 @@
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+import models, schemas
+from catalog_cache import catalog_cache
+
+# Each worker keeps its own discount index, so codes created through another
+# worker show up once the index is this old (seconds)
+DISCOUNT_INDEX_TTL = float(os.getenv("DISCOUNT_INDEX_TTL", "60"))
+PRICING_CACHE_SIZE = int(os.getenv("PRICING_CACHE_SIZE", "4096"))
+# catalog_cache.version only moves for writes made through this worker, so
+# price changes from other workers, the import CLI or direct DB edits reach
+# memoized cart prices once the entry is this old (seconds)
+PRICING_CACHE_TTL = float(os.getenv("PRICING_CACHE_TTL", "30"))
+
+
+class PricingError(ValueError):
+    pass
+
+
+class UnknownProduct(PricingError):
+    pass
+
+
+class InvalidDiscount(PricingError):
+    pass
+
+
+def normalize_code(code: str) -> str:
+    return code.strip().upper()
+
+
+class DiscountIndex:
+    # Active, unexpired codes in memory. Reloaded after create_discount, when
+    # the earliest valid_until passes, and every DISCOUNT_INDEX_TTL seconds.
+    # generation changes whenever the set of codes does, which invalidates
+    # memoized prices.
+    def __init__(self, ttl: float = DISCOUNT_INDEX_TTL):
+        self.ttl = ttl
+        self.generation = 0
+        self._codes = {}
+        self._next_expiry = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def refresh(self, db: Session):
+        now = datetime.datetime.utcnow()
+        rows = db.query(models.Discount.code, models.Discount.percentage, models.Discount.valid_until).filter(
+            models.Discount.is_active == True, models.Discount.valid_until > now
+        ).all()
+        codes = {normalize_code(code): (code, min(max(percentage or 0, 0), 100), valid_until) for code, percentage, valid_until in rows}
+        with self._lock:
+            if codes != self._codes:
+                self.generation += 1
+            self._codes = codes
+            self._next_expiry = min((valid_until for _, _, valid_until in codes.values()), default=None)
+            self._loaded_at = time.monotonic()
+
+    def ensure_current(self, db: Session):
+        with self._lock:
+            stale = (
+                self._loaded_at is None
+                or time.monotonic() - self._loaded_at > self.ttl
+                or (self._next_expiry is not None and datetime.datetime.utcnow() >= self._next_expiry)
+            )
+        if stale:
+            self.refresh(db)
+
+    def lookup(self, db: Session, code: Optional[str]):
+        # (code, percentage) or None when no code was given; unknown or
+        # expired codes raise InvalidDiscount
+        if not code or not code.strip():
+            return None
+        self.ensure_current(db)
+        entry = self._codes.get(normalize_code(code))
+        if entry is None or entry[2] <= datetime.datetime.utcnow():
+            raise InvalidDiscount(f"Invalid or expired discount code: {code.strip()}")
+        return entry[0], entry[1]
+
+
+class PricingCache:
+    # Priced saved carts keyed by cart version, discount code, discount index
+    # generation and catalog version. Changes to the cart or the codes always
+    # give a new key; product price changes only do when made through this
+    # worker, so entries also expire after ttl.
+    def __init__(self, max_entries: int = PRICING_CACHE_SIZE, ttl: float = PRICING_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, pricing):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), pricing)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+discount_index = DiscountIndex()
+pricing_cache = PricingCache()
+
+
+def unit_price(product_price, variation_price) -> int:
+    # A variation's own price overrides the product's
+    return variation_price if variation_price is not None else (product_price or 0)
+
+
+def build(lines, discount) -> schemas.CartPricing:
+    # lines: (product_id, variation_id, quantity, unit_price)
+    priced = [
+        schemas.PricedLine(product_id=product_id, variation_id=variation_id, quantity=quantity,
+                           unit_price=price, line_total=price * quantity)
+        for product_id, variation_id, quantity, price in lines
+    ]
+    subtotal = sum(line.line_total for line in priced)
+    code, percentage = discount or (None, 0)
+    discount_amount = subtotal * percentage // 100
+    return schemas.CartPricing(
+        lines=priced, subtotal=subtotal, discount_code=code, discount_percentage=percentage,
+        discount_amount=discount_amount, total=subtotal - discount_amount
+    )
+
+
+def price_lines(db: Session, lines: dict, discount) -> schemas.CartPricing:
+    # lines maps (product_id, variation_id) -> quantity, as from
+    # stock.order_lines. One query fetches every product and requested
+    # variation price.
+    if not lines:
+        return build([], discount)
+    product_ids = list({product_id for product_id, _ in lines})
+    variation_ids = list({variation_id for _, variation_id in lines if variation_id is not None})
+    rows = db.query(
+        models.Product.id, models.Product.price, models.ProductVariation.id, models.ProductVariation.price
+    ).outerjoin(
+        models.ProductVariation,
+        and_(models.ProductVariation.product_id == models.Product.id, models.ProductVariation.id.in_(variation_ids))
+    ).filter(models.Product.id.in_(product_ids), models.Product.is_active == True).all()
+
+    product_prices = {}
+    variation_prices = {}
+    for product_id, product_price, variation_id, variation_price in rows:
+        product_prices[product_id] = product_price
+        if variation_id is not None:
+            variation_prices[(product_id, variation_id)] = variation_price
+
+    priced = []
+    for (product_id, variation_id), quantity in lines.items():
+        if product_id not in product_prices:
+            raise UnknownProduct(f"Product {product_id} not found")
+        if variation_id is not None and (product_id, variation_id) not in variation_prices:
+            raise UnknownProduct(f"Variation {variation_id} not found for product {product_id}")
+        priced.append((product_id, variation_id, quantity,
+                       unit_price(product_prices[product_id], variation_prices.get((product_id, variation_id)))))
+    return build(priced, discount)
+
+
+def price_cart(db: Session, cart_id: int, discount) -> schemas.CartPricing:
+    # Saved cart lines with their product and variation prices in one query.
+    # Same rules as price_lines: inactive products and variations of another
+    # product are refused.
+    rows = db.query(
+        models.CartItem.product_id, models.CartItem.variation_id, models.CartItem.quantity,
+        models.Product.price, models.Product.is_active, models.ProductVariation.id, models.ProductVariation.price
+    ).join(
+        models.Product, models.Product.id == models.CartItem.product_id
+    ).outerjoin(
+        models.ProductVariation,
+        and_(models.ProductVariation.id == models.CartItem.variation_id,
+             models.ProductVariation.product_id == models.CartItem.product_id)
+    ).filter(
+        models.CartItem.cart_id == cart_id, models.CartItem.quantity > 0
+    ).order_by(models.CartItem.id).all()
+
+    priced = []
+    for product_id, variation_id, quantity, product_price, is_active, found_variation, variation_price in rows:
+        if not is_active:
+            raise UnknownProduct(f"Product {product_id} not found")
+        if variation_id is not None and found_variation is None:
+            raise UnknownProduct(f"Variation {variation_id} not found for product {product_id}")
+        priced.append((product_id, variation_id, quantity, unit_price(product_price, variation_price)))
+    return build(priced, discount)
+
+
+def quote_saved_cart(db: Session, user_id: int, code: Optional[str]) -> schemas.CartPricing:
+    # Memoized: repeated cart and checkout page views of an unchanged cart
+    # cost one indexed lookup of the cart version
+    discount = discount_index.lookup(db, code)
+    catalog_version = catalog_cache.version
+    cart = db.query(models.Cart.id, models.Cart.version).filter(models.Cart.user_id == user_id).first()
+    if cart is None:
+        return build([], discount)
+    key = (cart.id, cart.version, discount[0] if discount else None, discount_index.generation, catalog_version)
+    pricing = pricing_cache.get(key)
+    if pricing is None:
+        pricing = price_cart(db, cart.id, discount)
+        pricing_cache.set(key, pricing)
+    return pricing
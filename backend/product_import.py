@@ -0,0 +1,262 @@
+import csv
+import io
+import json
+import logging
+import os
+
+from pydantic import ValidationError
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from database import dialect_insert
+
+logger = logging.getLogger("miauhome.import")
+
+# Products per transaction / multi-row statement
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+# Per-row errors kept in the report; the rest are only counted
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+FORMATS = ("csv", "json", "ndjson")
+
+PRODUCT_FIELDS = ("sku", "name", "description", "price", "image_url", "category", "stock", "is_active")
+VARIATION_FIELDS = ("name", "variation_type", "price", "stock")
+
+
+class ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self):
+        return {
+            "processed": self.processed,
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def log_progress(report: ImportReport):
+    logger.info("Product import: %d processed, %d created, %d updated, %d failed",
+                report.processed, report.created, report.updated, report.failed)
+
+
+def detect_format(filename: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return extension if extension in FORMATS else "csv"
+
+
+def csv_records(lines):
+    # One row per variation: rows sharing a SKU are merged into one product,
+    # as long as they are consecutive. images is a |-separated list of URLs.
+    current, current_row = None, None
+    for row_number, row in enumerate(csv.DictReader(lines), start=2):
+        row = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+        sku = row.get("sku")
+        if current is not None and (not sku or sku != current.get("sku")):
+            yield current_row, current
+            current = None
+        if current is None:
+            current_row = row_number
+            current = {field: row[field] for field in PRODUCT_FIELDS if row.get(field) not in (None, "")}
+            current["variations"] = []
+            current["images"] = [{"url": url} for url in row.get("images", "").split("|") if url]
+        if row.get("variation_name"):
+            variation = {"name": row["variation_name"]}
+            for field in VARIATION_FIELDS[1:]:
+                if row.get(f"variation_{field}"):
+                    variation[field] = row[f"variation_{field}"]
+            current["variations"].append(variation)
+    if current is not None:
+        yield current_row, current
+
+
+def ndjson_records(lines):
+    for row_number, line in enumerate(lines, start=1):
+        if line.strip():
+            try:
+                yield row_number, json.loads(line)
+            except ValueError as e:
+                yield row_number, e
+
+
+def json_records(stream):
+    data = json.load(stream)
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of products")
+    yield from enumerate(data, start=1)
+
+
+def read_records(stream, fmt: str):
+    # stream is a binary file; CSV and NDJSON are read line by line
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        return csv_records(text)
+    if fmt == "ndjson":
+        return ndjson_records(text)
+    return json_records(text)
+
+
+def validated(records, report: ImportReport):
+    for row_number, record in records:
+        if isinstance(record, Exception):
+            report.error(row_number, str(record))
+            continue
+        try:
+            yield row_number, schemas.ProductImport.model_validate(record)
+        except ValidationError as e:
+            report.error(row_number, "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            ))
+
+
+def chunked(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def upsert_products(db: Session, items):
+    # Returns {sku: product_id} and the set of SKUs that already existed
+    skus = [item.sku for item in items]
+    existing = dict(db.query(models.Product.sku, models.Product.id).filter(models.Product.sku.in_(skus)).all())
+    rows = [{field: getattr(item, field) for field in PRODUCT_FIELDS} for item in items]
+    stmt = dialect_insert(db, models.Product.__table__)
+    if stmt is None:
+        for row in rows:
+            if row["sku"] in existing:
+                db.query(models.Product).filter(models.Product.id == existing[row["sku"]]).update(
+                    row, synchronize_session=False
+                )
+            else:
+                db.add(models.Product(**row))
+        db.flush()
+    else:
+        insert = stmt.values(rows)
+        db.execute(insert.on_conflict_do_update(
+            index_elements=["sku"],
+            set_={field: insert.excluded[field] for field in PRODUCT_FIELDS if field != "sku"}
+        ))
+    ids = dict(db.query(models.Product.sku, models.Product.id).filter(models.Product.sku.in_(skus)).all())
+    return ids, set(existing)
+
+
+def upsert_variations(db: Session, items, ids: dict):
+    # Variations are matched by name within their product. Ones missing from
+    # the import are left alone: carts and reservations may still point at them.
+    product_ids = [ids[item.sku] for item in items if item.variations]
+    if not product_ids:
+        return
+    existing = {
+        (product_id, name): variation_id
+        for variation_id, product_id, name in db.query(
+            models.ProductVariation.id, models.ProductVariation.product_id, models.ProductVariation.name
+        ).filter(models.ProductVariation.product_id.in_(product_ids))
+    }
+    inserts, updates = [], []
+    for item in items:
+        for variation in item.variations:
+            row = {**variation.model_dump(), "product_id": ids[item.sku]}
+            variation_id = existing.get((row["product_id"], row["name"]))
+            if variation_id is None:
+                inserts.append(row)
+            else:
+                updates.append({**row, "id": variation_id})
+    if inserts:
+        db.execute(models.ProductVariation.__table__.insert(), inserts)
+    if updates:
+        db.execute(update(models.ProductVariation), updates)
+
+
+def replace_images(db: Session, items, ids: dict):
+    product_ids = [ids[item.sku] for item in items if item.images]
+    if not product_ids:
+        return
+    db.query(models.ProductImage).filter(
+        models.ProductImage.product_id.in_(product_ids)
+    ).delete(synchronize_session=False)
+    db.execute(models.ProductImage.__table__.insert(), [
+        {"product_id": ids[item.sku], "url": image.url} for item in items for image in item.images
+    ])
+
+
+def import_chunk(db: Session, items):
+    # Later rows win when a SKU repeats inside the chunk
+    items = list({item.sku: item for item in items}.values())
+    ids, existing = upsert_products(db, items)
+    upsert_variations(db, items, ids)
+    replace_images(db, items, ids)
+    db.commit()
+    return len(items) - len(existing), len(existing)
+
+
+def run_import(db: Session, stream, fmt: str, chunk_size: int = IMPORT_CHUNK_SIZE, progress=None):
+    report = ImportReport()
+    try:
+        records = validated(read_records(stream, fmt), report)
+        for chunk in chunked(records, chunk_size):
+            try:
+                created, updated = import_chunk(db, [item for _, item in chunk])
+                report.created += created
+                report.updated += updated
+            except SQLAlchemyError:
+                # Find the offending rows by importing the chunk one product at a time
+                db.rollback()
+                for row_number, item in chunk:
+                    try:
+                        created, updated = import_chunk(db, [item])
+                        report.created += created
+                        report.updated += updated
+                    except SQLAlchemyError as e:
+                        db.rollback()
+                        report.error(row_number, str(e.orig if getattr(e, "orig", None) else e).splitlines()[0])
+            report.processed += len(chunk)
+            if progress:
+                progress(report)
+    except (ValueError, csv.Error) as e:
+        report.error(0, f"Could not read file: {e}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import database
+
+    parser = argparse.ArgumentParser(description="Import products from a CSV, JSON or NDJSON file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    def print_progress(report):
+        print(f"{report.processed} processed, {report.created} created, {report.updated} updated, {report.failed} failed")
+
+    session = database.SessionLocal()
+    try:
+        with open(args.path, "rb") as f:
+            result = run_import(session, f, detect_format(args.path, args.format), args.chunk_size, print_progress)
+    finally:
+        session.close()
+    for error in result.errors:
+        print(f"Row {error['row']}: {error['error']}")
+    print(json.dumps({key: value for key, value in result.as_dict().items() if key != "errors"}))
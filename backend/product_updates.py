@@ -0,0 +1,117 @@
+from sqlalchemy.orm import Session
+
+import models
+
+
+class ProductUpdateError(Exception):
+    pass
+
+
+class VariationInUse(ProductUpdateError):
+    pass
+
+
+def apply_fields(row, data: dict) -> bool:
+    # Only assign what actually changed, so untouched rows never reach the UPDATE
+    changed = False
+    for key, value in data.items():
+        if getattr(row, key) != value:
+            setattr(row, key, value)
+            changed = True
+    return changed
+
+
+def match_row(existing: dict, seen: set, row_id, key: str, value):
+    # Rows are matched by id. Clients that don't send ids fall back to the
+    # first unclaimed row with the same name/url, which keeps its id stable.
+    if row_id is not None:
+        row = existing.get(row_id)
+        if row is None:
+            raise ProductUpdateError(f"Row {row_id} does not belong to this product")
+        if row_id in seen:
+            raise ProductUpdateError(f"Row {row_id} appears more than once")
+        return row
+    for candidate_id, row in existing.items():
+        if candidate_id not in seen and value is not None and getattr(row, key) == value:
+            return row
+    return None
+
+
+def delete_variations(db: Session, product: models.Product, variation_ids: set):
+    # Checkouts take stock with an UPDATE on these rows, so locking them first
+    # means a reservation can't be added between the check and the delete
+    db.query(models.ProductVariation.id).filter(
+        models.ProductVariation.id.in_(variation_ids)
+    ).with_for_update().all()
+    if db.query(models.StockReservation.id).filter(
+        models.StockReservation.variation_id.in_(variation_ids),
+        models.StockReservation.status == "held"
+    ).first():
+        raise VariationInUse("A variation being removed is reserved by a pending order")
+    # A released reservation is taken again if its order gets paid late
+    # (stock.commit_order); with the variation gone that would hit the
+    # product's stock instead, so it is cancelled for good
+    db.query(models.StockReservation).filter(
+        models.StockReservation.variation_id.in_(variation_ids),
+        models.StockReservation.status == "released"
+    ).update({models.StockReservation.status: "cancelled"}, synchronize_session=False)
+    # Past reservations keep their product and quantity; cart lines for the
+    # variation are dropped and their carts bumped so clients refetch
+    db.query(models.StockReservation).filter(
+        models.StockReservation.variation_id.in_(variation_ids),
+        models.StockReservation.status != "held"
+    ).update({models.StockReservation.variation_id: None}, synchronize_session=False)
+    cart_ids = db.query(models.CartItem.cart_id).filter(models.CartItem.variation_id.in_(variation_ids))
+    db.query(models.Cart).filter(models.Cart.id.in_(cart_ids.scalar_subquery())).update(
+        {models.Cart.version: models.Cart.version + 1}, synchronize_session=False
+    )
+    db.query(models.CartItem).filter(
+        models.CartItem.variation_id.in_(variation_ids)
+    ).delete(synchronize_session=False)
+    for variation in [v for v in product.variations if v.id in variation_ids]:
+        product.variations.remove(variation)
+
+
+def sync_variations(db: Session, product: models.Product, incoming, replace: bool = True) -> bool:
+    # incoming is a list of dicts, optionally with an id. With replace (PUT)
+    # variations missing from the list are deleted; without it (PATCH) only
+    # the listed ones are touched.
+    existing = {variation.id: variation for variation in product.variations}
+    seen = set()
+    changed = False
+    for data in incoming:
+        data = dict(data)
+        variation = match_row(existing, seen, data.pop("id", None), "name", data.get("name"))
+        if variation is None:
+            if not data.get("name"):
+                raise ProductUpdateError("New variations need a name")
+            product.variations.append(models.ProductVariation(**data))
+            changed = True
+        else:
+            seen.add(variation.id)
+            changed |= apply_fields(variation, data)
+    removed = set(existing) - seen
+    if replace and removed:
+        delete_variations(db, product, removed)
+        changed = True
+    return changed
+
+
+def sync_images(product: models.Product, incoming) -> bool:
+    # Always a full list: images missing from it are deleted
+    existing = {image.id: image for image in product.images}
+    seen = set()
+    changed = False
+    for data in incoming:
+        data = dict(data)
+        image = match_row(existing, seen, data.pop("id", None), "url", data.get("url"))
+        if image is None:
+            product.images.append(models.ProductImage(**data))
+            changed = True
+        else:
+            seen.add(image.id)
+            changed |= apply_fields(image, data)
+    for image in [image for image in product.images if image.id is not None and image.id not in seen]:
+        product.images.remove(image)
+        changed = True
+    return changed
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 import datetime
 
@@ -33,6 +33,7 @@ class ProductVariation(ProductVariationBase):
         from_attributes = True
 
 class ProductBase(BaseModel):
+    sku: Optional[str] = None
     name: str
     description: str
     price: int
@@ -45,6 +46,43 @@ class ProductCreate(ProductBase):
     variations: List[ProductVariationCreate] = []
     images: List[ProductImageCreate] = []
 
+# id is optional on updates: rows sent with an id are updated in place,
+# rows without one are added
+class ProductImageUpdate(ProductImageBase):
+    id: Optional[int] = None
+
+class ProductVariationUpdate(ProductVariationBase):
+    id: Optional[int] = None
+
+class ProductVariationPatch(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    variation_type: Optional[str] = None
+    price: Optional[int] = None
+    stock: Optional[int] = None
+
+class ProductUpdate(ProductBase):
+    variations: List[ProductVariationUpdate] = []
+    images: List[ProductImageUpdate] = []
+
+class ProductPatch(BaseModel):
+    sku: Optional[str] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[int] = None
+    image_url: Optional[str] = None
+    category: Optional[str] = None
+    stock: Optional[int] = None
+    is_active: Optional[bool] = None
+    # Only the listed variations are touched; removed_variation_ids deletes
+    variations: Optional[List[ProductVariationPatch]] = None
+    removed_variation_ids: List[int] = []
+    # When given, the full image list
+    images: Optional[List[ProductImageUpdate]] = None
+
+class ProductImport(ProductCreate):
+    sku: str = Field(min_length=1)
+
 class Product(ProductBase):
     id: int
     variations: List[ProductVariation] = []
@@ -53,6 +91,27 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductFilters(BaseModel):
+    category: Optional[str] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    variation_type: Optional[str] = None
+    in_stock: bool = False
+
+class CategoryFacet(BaseModel):
+    category: str
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    min_price: int
+    max_price: Optional[int] = None
+    count: int
+
+class ProductFacets(BaseModel):
+    total: int
+    categories: List[CategoryFacet] = []
+    price_buckets: List[PriceBucketFacet] = []
+
 # Discount Schema
 class DiscountBase(BaseModel):
     code: str
@@ -124,14 +183,32 @@ class Order(BaseModel):
     class Config:
         from_attributes = True
 
-class OrderCreate(BaseModel):
-    total_amount: int
-    guest_email: Optional[str] = None
-    guest_address: Optional[str] = None
-
 class OrderStatusUpdate(BaseModel):
     status: str
 
+class OrderFilters(BaseModel):
+    status: Optional[str] = None
+    created_from: Optional[datetime.datetime] = None
+    created_to: Optional[datetime.datetime] = None
+    user_id: Optional[int] = None
+    guest_email: Optional[str] = None
+
+class SalesPoint(BaseModel):
+    bucket: datetime.datetime
+    order_count: int
+    sales_total: int
+
+class CategoryUnits(BaseModel):
+    category: str
+    units: int
+
+class SalesTimeseries(BaseModel):
+    period: str
+    start: datetime.datetime
+    end: datetime.datetime
+    points: List[SalesPoint]
+    categories: List[CategoryUnits]
+
 # User Schemas
 class UserBase(BaseModel):
     email: str
@@ -162,6 +239,12 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class AuthenticatedUser(BaseModel):
+    id: int
+    email: str
+    is_admin: bool = False
+    is_active: bool = True
+
 class CartItemBase(BaseModel):
     product_id: int
     variation_id: Optional[int] = None
@@ -180,7 +263,49 @@ class CartItem(CartItemBase):
 
 class Cart(BaseModel):
     id: int
+    version: int = 0
     items: List[CartItem] = []
 
     class Config:
         from_attributes = True
+
+class CartLine(BaseModel):
+    product_id: int
+    variation_id: Optional[int] = None
+
+class CartLineQuantity(CartLine):
+    quantity: int = Field(ge=0)
+
+class CartSync(BaseModel):
+    add: List[CartLineQuantity] = []    # added to the current quantity
+    set: List[CartLineQuantity] = []    # replaces the quantity, 0 removes the line
+    remove: List[CartLine] = []
+
+class OrderCreate(BaseModel):
+    # What the client showed; the charged amount is always priced server-side
+    total_amount: Optional[int] = None
+    guest_email: Optional[str] = None
+    guest_address: Optional[str] = None
+    # Lines to reserve stock for. Logged-in users may leave it out to check out their saved cart.
+    items: Optional[List[CartLineQuantity]] = None
+    discount_code: Optional[str] = None
+
+class PricedLine(BaseModel):
+    product_id: int
+    variation_id: Optional[int] = None
+    quantity: int
+    unit_price: int
+    line_total: int
+
+class CartPricing(BaseModel):
+    lines: List[PricedLine] = []
+    subtotal: int
+    discount_code: Optional[str] = None
+    discount_percentage: int = 0
+    discount_amount: int = 0
+    total: int
+
+class PricingRequest(BaseModel):
+    # Without items, the logged-in user's saved cart is priced
+    items: Optional[List[CartLineQuantity]] = None
+    discount_code: Optional[str] = None
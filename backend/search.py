@@ -0,0 +1,147 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from sqlalchemy import DDL, event, or_, text
+from sqlalchemy.orm import Session
+
+import models
+from catalog_cache import catalog_cache
+
+# The query must use the exact same expression as the index for Postgres to use it
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('spanish', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(category, '')), 'B') || "
+    "setweight(to_tsvector('spanish', coalesce(description, '')), 'C')"
+)
+
+SEARCH_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_products_search ON products USING gin (({SEARCH_VECTOR}))",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+]
+
+for statement in SEARCH_INDEX_DDL:
+    event.listen(models.Product.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+PG_SEARCH_QUERY = text(f"""
+    SELECT products.id,
+           ts_rank({SEARCH_VECTOR}, query) + word_similarity(:term, products.name) AS rank
+    FROM products, websearch_to_tsquery('spanish', :term) query
+    WHERE products.is_active
+      AND (({SEARCH_VECTOR}) @@ query OR :term <% products.name)
+    ORDER BY rank DESC, products.id
+    LIMIT :limit
+""")
+
+
+def normalize(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value or "").lower()
+    return "".join(c for c in value if not unicodedata.combining(c))
+
+
+def tokenize(value: str):
+    return re.findall(r"\w+", normalize(value))
+
+
+def trigrams(word: str):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InMemorySearchIndex:
+    # Fallback for databases without tsvector/pg_trgm (SQLite test runs).
+    # Rebuilt lazily whenever the catalog version changes.
+    FIELD_WEIGHTS = {"name": 1.0, "category": 0.6, "description": 0.3}
+    MIN_SIMILARITY = 0.4
+
+    def __init__(self):
+        self.version = None
+        self._lock = threading.Lock()
+        self._words = {}
+        self._grams = defaultdict(set)
+
+    def ensure_current(self, db: Session) -> bool:
+        # False when there is no index to serve yet
+        if self.version == catalog_cache.version:
+            return True
+        # Never wait on a rebuild in progress: under DB_ASYNC it runs on the event
+        # loop thread, so blocking here would deadlock. Serve the old index
+        # instead, if there is one.
+        if not self._lock.acquire(blocking=False):
+            return self.version is not None
+        try:
+            version = catalog_cache.version
+            if self.version == version:
+                return True
+            words = {}
+            grams = defaultdict(set)
+            rows = db.query(
+                models.Product.id, models.Product.name, models.Product.category, models.Product.description
+            ).filter(models.Product.is_active == True).all()
+            for product_id, name, category, description in rows:
+                fields = {"name": name, "category": category, "description": description}
+                for field, value in fields.items():
+                    for word in tokenize(value):
+                        weight = words.setdefault(word, {})
+                        weight[product_id] = max(weight.get(product_id, 0), self.FIELD_WEIGHTS[field])
+            for word in words:
+                for gram in trigrams(word):
+                    grams[gram].add(word)
+            self._words, self._grams, self.version = words, grams, version
+            return True
+        finally:
+            self._lock.release()
+
+    def similar_words(self, term: str):
+        term_grams = trigrams(term)
+        counts = defaultdict(int)
+        for gram in term_grams:
+            for word in self._grams.get(gram, ()):
+                counts[word] += 1
+        for word, shared in counts.items():
+            score = shared / len(term_grams | trigrams(word))
+            if word.startswith(term):
+                score = max(score, 0.9)
+            if score >= self.MIN_SIMILARITY:
+                yield word, score
+
+    def search(self, db: Session, q: str, limit: int):
+        if not self.ensure_current(db):
+            # Cold start with the first build still running in another request
+            return like_search(db, q, limit)
+        scores = defaultdict(float)
+        for term in tokenize(q):
+            best = {}
+            for word, similarity in self.similar_words(term):
+                for product_id, weight in self._words[word].items():
+                    best[product_id] = max(best.get(product_id, 0), similarity * weight)
+            for product_id, score in best.items():
+                scores[product_id] += score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+
+def like_search(db: Session, q: str, limit: int):
+    # Plain substring match on every term, no typo tolerance or ranking
+    terms = re.findall(r"\w+", (q or "").lower())
+    if not terms:
+        return []
+    query = db.query(models.Product.id).filter(models.Product.is_active == True)
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.filter(or_(
+            models.Product.name.ilike(pattern), models.Product.category.ilike(pattern),
+            models.Product.description.ilike(pattern)
+        ))
+    return [product_id for product_id, in query.order_by(models.Product.id).limit(limit)]
+
+
+memory_index = InMemorySearchIndex()
+
+
+def search_product_ids(db: Session, q: str, limit: int):
+    if db.get_bind().dialect.name == "postgresql":
+        return [row.id for row in db.execute(PG_SEARCH_QUERY, {"term": q, "limit": limit})]
+    return memory_index.search(db, q, limit)
@@ -0,0 +1,233 @@
+import datetime
+import json
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+import models
+from database import dialect_insert
+
+PERIODS = ("hour", "day")
+# An order counts as a sale from the moment its payment is confirmed
+SOLD_STATUSES = ("paid", "shipped", "delivered")
+# Bigger tables are counted from the planner's row estimate on Postgres
+EXACT_COUNT_LIMIT = 100000
+# Rows per multi-row upsert, well under SQLite's bound parameter limit
+UPSERT_BATCH = 1000
+
+
+def bucket_start(moment: datetime.datetime, period: str) -> datetime.datetime:
+    if period == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def increment(db: Session, table, keys, rows):
+    # rows maps a tuple of key values to a dict of counter increments. Rows are
+    # written in key order so concurrent payments lock rollup rows in the same order.
+    if not rows:
+        return
+    values = [{**dict(zip(keys, key)), **counters} for key, counters in sorted(rows.items())]
+    counters = list(values[0].keys() - set(keys))
+    stmt = dialect_insert(db, table)
+    if stmt is None:
+        for row in values:
+            updated = db.execute(
+                table.update()
+                .where(*[table.c[k] == row[k] for k in keys])
+                .values({c: table.c[c] + row[c] for c in counters})
+            ).rowcount
+            if not updated:
+                db.execute(table.insert().values(row))
+        return
+    insert = stmt.values(values)
+    db.execute(insert.on_conflict_do_update(
+        index_elements=keys, set_={c: table.c[c] + insert.excluded[c] for c in counters}
+    ))
+
+
+def add_sales(db: Session, sales: dict):
+    # sales maps (period, bucket_start) -> (order_count, sales_total)
+    increment(db, models.SalesRollup.__table__, ["period", "bucket_start"], {
+        key: {"order_count": count, "sales_total": total} for key, (count, total) in sales.items()
+    })
+
+
+def add_category_units(db: Session, units: dict):
+    # units maps (day bucket_start, category) -> units sold
+    increment(db, models.CategorySalesRollup.__table__, ["bucket_start", "category"], {
+        key: {"units": count} for key, count in units.items()
+    })
+
+
+def record_payment(db: Session, order_id: int, total_amount: int) -> bool:
+    # Adds a paid order to the rollups inside the caller's transaction. paid_at
+    # is claimed with a conditional UPDATE, so a repeated confirmation (or an
+    # admin marking the order paid later) never counts the same sale twice.
+    paid_at = datetime.datetime.utcnow()
+    claimed = db.query(models.Order).filter(
+        models.Order.id == order_id, models.Order.paid_at.is_(None)
+    ).update({models.Order.paid_at: paid_at}, synchronize_session=False)
+    if not claimed:
+        return False
+
+    add_sales(db, {(period, bucket_start(paid_at, period)): (1, total_amount or 0) for period in PERIODS})
+    day = bucket_start(paid_at, "day")
+    add_category_units(db, {(day, category): units for category, units in order_units(db, order_id)})
+    return True
+
+
+def reverse_payment(db: Session, order_id: int, total_amount: int) -> bool:
+    # The order left SOLD_STATUSES (failed, cancelled, refunded...): takes the
+    # sale back out of the buckets it was counted in. Clearing paid_at only if
+    # it still holds the value read here makes a repeat a no-op, and lets the
+    # order be counted again if it is paid later.
+    paid_at = db.query(models.Order.paid_at).filter(models.Order.id == order_id).scalar()
+    if paid_at is None:
+        return False
+    released = db.query(models.Order).filter(
+        models.Order.id == order_id, models.Order.paid_at == paid_at
+    ).update({models.Order.paid_at: None}, synchronize_session=False)
+    if not released:
+        return False
+
+    add_sales(db, {(period, bucket_start(paid_at, period)): (-1, -(total_amount or 0)) for period in PERIODS})
+    day = bucket_start(paid_at, "day")
+    add_category_units(db, {(day, category): -units for category, units in order_units(db, order_id)})
+    return True
+
+
+def order_units(db: Session, order_id: int):
+    # (category, units) for the order's committed stock
+    lines = db.query(models.Product.category, func.sum(models.StockReservation.quantity)).join(
+        models.Product, models.Product.id == models.StockReservation.product_id
+    ).filter(
+        models.StockReservation.order_id == order_id,
+        models.StockReservation.status == "committed"
+    ).group_by(models.Product.category).all()
+    return [(category or "", units) for category, units in lines]
+
+
+def estimated_count(db: Session, model) -> int:
+    # count(*) reads the whole table on Postgres. Past EXACT_COUNT_LIMIT rows the
+    # estimate kept by autovacuum/ANALYZE is close enough for a dashboard.
+    if db.get_bind().dialect.name == "postgresql":
+        estimate = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": model.__tablename__}
+        ).scalar()
+        if estimate is not None and estimate >= EXACT_COUNT_LIMIT:
+            return estimate
+    return db.query(func.count(model.id)).scalar()
+
+
+def estimated_query_count(db: Session, query) -> int:
+    # Same idea for a filtered query: ask the planner how many rows it expects,
+    # and only count exactly when that is small
+    if db.get_bind().dialect.name == "postgresql":
+        sql = query.statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+        plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        if estimate >= EXACT_COUNT_LIMIT:
+            return estimate
+    return query.order_by(None).count()
+
+
+def sales_timeseries(db: Session, period: str, start: datetime.datetime, end: datetime.datetime):
+    # Reads only the rollups; buckets without sales come back as zeros
+    first, last = bucket_start(start, period), bucket_start(end, period)
+    rows = db.query(
+        models.SalesRollup.bucket_start, models.SalesRollup.order_count, models.SalesRollup.sales_total
+    ).filter(
+        models.SalesRollup.period == period,
+        models.SalesRollup.bucket_start >= first,
+        models.SalesRollup.bucket_start <= last
+    ).all()
+    by_bucket = {row.bucket_start: row for row in rows}
+    step = datetime.timedelta(hours=1) if period == "hour" else datetime.timedelta(days=1)
+    points = []
+    bucket = first
+    while bucket <= last:
+        row = by_bucket.get(bucket)
+        points.append({
+            "bucket": bucket,
+            "order_count": row.order_count if row else 0,
+            "sales_total": row.sales_total if row else 0,
+        })
+        bucket += step
+
+    categories = db.query(
+        models.CategorySalesRollup.category, func.sum(models.CategorySalesRollup.units)
+    ).filter(
+        models.CategorySalesRollup.bucket_start >= bucket_start(start, "day"),
+        models.CategorySalesRollup.bucket_start <= bucket_start(end, "day")
+    ).group_by(models.CategorySalesRollup.category).order_by(
+        func.sum(models.CategorySalesRollup.units).desc()
+    ).all()
+
+    return {
+        "period": period,
+        "start": first,
+        "end": last,
+        "points": points,
+        "categories": [{"category": category, "units": units or 0} for category, units in categories],
+    }
+
+
+def backfill(db: Session, batch_size: int = 10000):
+    # Rebuilds every rollup from the orders table in one transaction. Sold
+    # orders without paid_at are stamped with created_at so they are never
+    # counted again. Run it while no payments are being confirmed.
+    db.query(models.SalesRollup).delete(synchronize_session=False)
+    db.query(models.CategorySalesRollup).delete(synchronize_session=False)
+    db.query(models.Order).filter(
+        models.Order.status.in_(SOLD_STATUSES), models.Order.paid_at.is_(None)
+    ).update({models.Order.paid_at: models.Order.created_at}, synchronize_session=False)
+
+    sales = {}
+    orders = db.query(models.Order.paid_at, models.Order.total_amount).filter(
+        models.Order.paid_at.isnot(None)
+    ).yield_per(batch_size)
+    for paid_at, total_amount in orders:
+        for period in PERIODS:
+            key = (period, bucket_start(paid_at, period))
+            count, total = sales.get(key, (0, 0))
+            sales[key] = (count + 1, total + (total_amount or 0))
+
+    units = {}
+    lines = db.query(models.Order.paid_at, models.Product.category, models.StockReservation.quantity).join(
+        models.StockReservation, models.StockReservation.order_id == models.Order.id
+    ).join(
+        models.Product, models.Product.id == models.StockReservation.product_id
+    ).filter(
+        models.Order.paid_at.isnot(None), models.StockReservation.status == "committed"
+    ).yield_per(batch_size)
+    for paid_at, category, quantity in lines:
+        key = (bucket_start(paid_at, "day"), category or "")
+        units[key] = units.get(key, 0) + quantity
+
+    sales_items = list(sales.items())
+    for i in range(0, len(sales_items), UPSERT_BATCH):
+        add_sales(db, dict(sales_items[i:i + UPSERT_BATCH]))
+    unit_items = list(units.items())
+    for i in range(0, len(unit_items), UPSERT_BATCH):
+        add_category_units(db, dict(unit_items[i:i + UPSERT_BATCH]))
+    db.commit()
+    return len(sales), len(units)
+
+
+if __name__ == "__main__":
+    import sys
+    import database
+
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python stats.py backfill")
+        sys.exit(1)
+    session = database.SessionLocal()
+    try:
+        buckets, category_buckets = backfill(session)
+        print(f"Rebuilt {buckets} sales buckets and {category_buckets} category buckets.")
+    finally:
+        session.close()
@@ -0,0 +1,180 @@
+import datetime
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+from catalog_cache import catalog_cache
+
+logger = logging.getLogger("miauhome.stock")
+
+# Must outlast the Webpay payment form, or paid orders find their stock released
+STOCK_RESERVATION_MINUTES = float(os.getenv("STOCK_RESERVATION_MINUTES", "15"))
+STOCK_SWEEP_INTERVAL = float(os.getenv("STOCK_SWEEP_INTERVAL", "60"))
+STOCK_SWEEP_BATCH = int(os.getenv("STOCK_SWEEP_BATCH", "500"))
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: int, variation_id=None):
+        target = f"product {product_id}" + (f" variation {variation_id}" if variation_id is not None else "")
+        super().__init__(f"Not enough stock for {target}")
+        self.product_id = product_id
+        self.variation_id = variation_id
+
+
+def order_lines(db: Session, user_id, items):
+    # (product_id, variation_id) -> quantity, from the request or the user's saved cart
+    if items is None:
+        if user_id is None:
+            return {}
+        items = db.query(
+            models.CartItem.product_id, models.CartItem.variation_id, models.CartItem.quantity
+        ).join(models.Cart).filter(models.Cart.user_id == user_id).all()
+    lines = {}
+    for item in items:
+        if item.quantity > 0:
+            key = (item.product_id, item.variation_id)
+            lines[key] = lines.get(key, 0) + item.quantity
+    return lines
+
+
+def lock_order(lines: dict):
+    # Every transaction touches stock rows in the same order (variations by id,
+    # then products by id), so two checkouts can't deadlock on each other
+    return sorted(lines.items(), key=lambda item: (item[0][1] is None, item[0][1] or item[0][0]))
+
+
+def adjust_stock(db: Session, product_id: int, variation_id, delta: int) -> bool:
+    # One conditional UPDATE: the database checks and changes stock under the
+    # row lock, so concurrent checkouts can't both take the last unit
+    if variation_id is None:
+        model = models.Product
+        query = db.query(model).filter(model.id == product_id)
+    else:
+        model = models.ProductVariation
+        query = db.query(model).filter(model.id == variation_id, model.product_id == product_id)
+    if delta < 0:
+        query = query.filter(model.stock >= -delta)
+    changed = query.update({model.stock: model.stock + delta}, synchronize_session=False) == 1
+    if changed:
+        db.info["stock_changed"] = True
+    return changed
+
+
+# Cached catalog responses show stock (and filter on it), so they are dropped
+# once a stock change commits; a rolled back reservation leaves them alone
+@event.listens_for(Session, "after_commit")
+def bump_catalog_on_stock_change(session):
+    if session.info.pop("stock_changed", False):
+        catalog_cache.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_stock_change(session):
+    session.info.pop("stock_changed", None)
+
+
+def check_available(db: Session, lines: dict):
+    # Plain reads never wait on row locks: once a hot item sells out, later
+    # checkouts are turned away here instead of queueing behind the writers
+    variation_ids = [variation_id for _, variation_id in lines if variation_id is not None]
+    product_ids = [product_id for product_id, variation_id in lines if variation_id is None]
+    variations = dict(db.query(models.ProductVariation.id, models.ProductVariation.stock).filter(
+        models.ProductVariation.id.in_(variation_ids)
+    ).all()) if variation_ids else {}
+    products = dict(db.query(models.Product.id, models.Product.stock).filter(
+        models.Product.id.in_(product_ids)
+    ).all()) if product_ids else {}
+    for (product_id, variation_id), quantity in lines.items():
+        available = products.get(product_id) if variation_id is None else variations.get(variation_id)
+        if (available or 0) < quantity:
+            raise OutOfStock(product_id, variation_id)
+
+
+def reserve_stock(db: Session, order_id: int, lines: dict):
+    # Called in the order's transaction. Reservation rows go in first and the
+    # decrements last, so hot stock rows stay locked only until the commit that
+    # follows. Raises OutOfStock; the caller must roll back.
+    check_available(db, lines)
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=STOCK_RESERVATION_MINUTES)
+    db.add_all([
+        models.StockReservation(
+            order_id=order_id, product_id=product_id, variation_id=variation_id,
+            quantity=quantity, status="held", expires_at=expires_at
+        )
+        for (product_id, variation_id), quantity in lines.items()
+    ])
+    db.flush()
+    for (product_id, variation_id), quantity in lock_order(lines):
+        if not adjust_stock(db, product_id, variation_id, -quantity):
+            raise OutOfStock(product_id, variation_id)
+
+
+def held_reservations(db: Session):
+    return db.query(
+        models.StockReservation.id, models.StockReservation.order_id, models.StockReservation.product_id,
+        models.StockReservation.variation_id, models.StockReservation.quantity
+    ).filter(models.StockReservation.status == "held")
+
+
+def set_status(db: Session, reservation_ids, status: str):
+    if reservation_ids:
+        db.query(models.StockReservation).filter(
+            models.StockReservation.id.in_(reservation_ids)
+        ).update({models.StockReservation.status: status}, synchronize_session=False)
+
+
+def release_rows(db: Session, rows) -> int:
+    # rows must be held reservations locked by the caller
+    set_status(db, [row.id for row in rows], "released")
+    totals = {}
+    for row in rows:
+        key = (row.product_id, row.variation_id)
+        totals[key] = totals.get(key, 0) + row.quantity
+    for (product_id, variation_id), quantity in lock_order(totals):
+        adjust_stock(db, product_id, variation_id, quantity)
+    return len(rows)
+
+
+def release_order(db: Session, order_id: int) -> int:
+    # Payment failed or was abandoned: give the stock back. Only held rows are
+    # touched, so running it twice (or after the sweeper) is harmless.
+    rows = held_reservations(db).filter(models.StockReservation.order_id == order_id).with_for_update().all()
+    return release_rows(db, rows)
+
+
+def commit_order(db: Session, order_id: int):
+    # Payment went through, so the stock stays taken
+    rows = held_reservations(db).filter(models.StockReservation.order_id == order_id).with_for_update().all()
+    set_status(db, [row.id for row in rows], "committed")
+
+    # Paid after the reservation expired: the sweeper already gave the stock back
+    expired = db.query(models.StockReservation).filter(
+        models.StockReservation.order_id == order_id,
+        models.StockReservation.status == "released"
+    ).with_for_update().all()
+    for reservation in expired:
+        if not adjust_stock(db, reservation.product_id, reservation.variation_id, -reservation.quantity):
+            logger.warning(
+                "Order %s was paid after its reservation expired and product %s (variation %s) ran out",
+                order_id, reservation.product_id, reservation.variation_id
+            )
+        reservation.status = "committed"
+
+
+def release_expired(db: Session, batch_size: int = STOCK_SWEEP_BATCH) -> int:
+    # SKIP LOCKED lets several workers sweep at once and never blocks on a
+    # reservation that a payment confirmation is settling right now
+    rows = held_reservations(db).filter(
+        models.StockReservation.expires_at < datetime.datetime.utcnow()
+    ).order_by(models.StockReservation.expires_at).limit(batch_size).with_for_update(skip_locked=True).all()
+    released = release_rows(db, rows)
+    order_ids = {row.order_id for row in rows}
+    if order_ids:
+        db.query(models.Order).filter(
+            models.Order.id.in_(order_ids), models.Order.status == "pending"
+        ).update({models.Order.status: "failed"}, synchronize_session=False)
+    db.commit()
+    return released
@@ -1,27 +1,125 @@
 from transbank.webpay.webpay_plus.transaction import Transaction as WebpayPlusTransaction
+from transbank.webpay.webpay_plus.request import TransactionCreateRequest
+from transbank.webpay.webpay_plus.schema import TransactionCreateRequestSchema
 from transbank.common.options import WebpayOptions
+from transbank.common.headers_builder import HeadersBuilder
 from transbank.common.integration_commerce_codes import IntegrationCommerceCodes
 from transbank.common.integration_api_keys import IntegrationApiKeys
-from transbank.common.integration_type import IntegrationType
+from transbank.common.integration_type import IntegrationType, webpay_host
+import asyncio
+import httpx
 import os
+import time
+import uuid
+
+# "webpay" talks to Transbank; "fake" answers locally so checkout can be load-tested offline
+PAYMENT_GATEWAY = os.getenv("PAYMENT_GATEWAY", "webpay")
+
+TRANSBANK_CONNECT_TIMEOUT = float(os.getenv("TRANSBANK_CONNECT_TIMEOUT", "3"))
+TRANSBANK_TIMEOUT = float(os.getenv("TRANSBANK_TIMEOUT", "10"))
+TRANSBANK_MAX_CONNECTIONS = int(os.getenv("TRANSBANK_MAX_CONNECTIONS", "20"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("TRANSBANK_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("TRANSBANK_BREAKER_RESET", "30"))
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    pass
+
+
+class CircuitBreaker:
+    # closed: calls go through. open: calls fail immediately until reset_seconds
+    # have passed. half-open: one trial call decides whether to close again.
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self.trial_in_flight):
+            raise PaymentGatewayUnavailable("Payment gateway temporarily unavailable")
+        if state == "half-open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
 
 class TransbankService:
-    @staticmethod
-    def get_webpay_plus():
-        options = WebpayOptions(IntegrationCommerceCodes.WEBPAY_PLUS, IntegrationApiKeys.WEBPAY, IntegrationType.TEST)
-        tx = WebpayPlusTransaction(options)
-        return tx
-
-    @classmethod
-    def start_webpay_plus(cls, buy_order, session_id, amount, return_url):
-        tx = cls.get_webpay_plus()
-        res = tx.create(buy_order, session_id, amount, return_url)
+    # Webpay Plus over one pooled httpx client. The SDK is still used for
+    # hosts, headers and request bodies, but it opens a new connection per call
+    # and blocks, so the HTTP round trip is done here.
+    def __init__(self, options: WebpayOptions = None):
+        self.options = options or WebpayOptions(
+            IntegrationCommerceCodes.WEBPAY_PLUS, IntegrationApiKeys.WEBPAY, IntegrationType.TEST
+        )
+        self.breaker = CircuitBreaker()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=webpay_host(self.options.integration_type),
+                headers=HeadersBuilder.build(self.options),
+                timeout=httpx.Timeout(TRANSBANK_TIMEOUT, connect=TRANSBANK_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=TRANSBANK_MAX_CONNECTIONS,
+                    max_keepalive_connections=TRANSBANK_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def _request(self, method, endpoint, content=None):
+        self.breaker.before_call()
+        try:
+            response = await self.client.request(method, endpoint, content=content)
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            raise PaymentGatewayUnavailable(f"Webpay request failed: {e!r}")
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise PaymentGatewayUnavailable(f"Webpay returned {response.status_code}")
+        self.breaker.record_success()
+
+        data = response.json() if response.text else {}
+        if not 200 <= response.status_code < 300:
+            message = data.get("error_message") or data.get("description") or response.text
+            raise PaymentGatewayError(message)
+        return data
+
+    async def start_webpay_plus(self, buy_order, session_id, amount, return_url):
+        request = TransactionCreateRequest(buy_order, session_id, amount, return_url)
+        res = await self._request(
+            "POST", WebpayPlusTransaction.CREATE_ENDPOINT, TransactionCreateRequestSchema().dumps(request)
+        )
         return {"url": res['url'], "token": res['token']}
 
-    @classmethod
-    def commit_webpay_plus(cls, token):
-        tx = cls.get_webpay_plus()
-        res = tx.commit(token)
+    async def commit_webpay_plus(self, token):
+        res = await self._request("PUT", WebpayPlusTransaction.COMMIT_ENDPOINT.format(token), "{}")
         return {
             "status": res.get('status'),
             "buy_order": res.get('buy_order'),
@@ -29,3 +127,53 @@ class TransbankService:
             "vci": res.get('vci'),
             "response_code": res.get('response_code')
         }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class FakeTransbankService:
+    # Local stand-in with the same interface. Every payment is authorized unless
+    # FAKE_GATEWAY_STATUS says otherwise; FAKE_GATEWAY_LATENCY adds a delay in seconds.
+    def __init__(self):
+        self.status = os.getenv("FAKE_GATEWAY_STATUS", "AUTHORIZED")
+        self.latency = float(os.getenv("FAKE_GATEWAY_LATENCY", "0"))
+        self.transactions = {}
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def start_webpay_plus(self, buy_order, session_id, amount, return_url):
+        await self._delay()
+        token = uuid.uuid4().hex + uuid.uuid4().hex[:32]
+        self.transactions[token] = {"buy_order": buy_order, "amount": amount}
+        if len(self.transactions) > 10000:
+            # Load tests rarely confirm every checkout; drop the oldest
+            self.transactions.pop(next(iter(self.transactions)))
+        return {"url": return_url, "token": token}
+
+    async def commit_webpay_plus(self, token):
+        await self._delay()
+        transaction = self.transactions.pop(token, {})
+        return {
+            "status": self.status,
+            "buy_order": transaction.get("buy_order"),
+            "amount": transaction.get("amount"),
+            "vci": "TSY",
+            "response_code": 0 if self.status == "AUTHORIZED" else -1
+        }
+
+    async def close(self):
+        pass
+
+
+def get_payment_gateway():
+    if PAYMENT_GATEWAY == "fake":
+        return FakeTransbankService()
+    return TransbankService()
+
+
+payment_gateway = get_payment_gateway()
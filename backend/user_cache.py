@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Delete, Update, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# The cache is per process and invalidation below only reaches the process
+# that made the change, so other workers keep serving a deactivated or demoted
+# user for up to this many seconds. Keep it short.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "15"))
+
+# Changing any of these must drop the cached identity
+WATCHED_ATTRIBUTES = ("email", "is_admin", "is_active")
+
+
+class UserCache:
+    def __init__(self, max_entries: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, subject: str):
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(subject)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[subject]
+            self.misses += 1
+            return None
+
+    def set(self, subject: str, user):
+        with self._lock:
+            self._entries[subject] = (time.monotonic(), user)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop(subject, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_users(session, flush_context):
+    # Entries are dropped only after commit, otherwise a concurrent request
+    # could re-cache the old row between the flush and the commit.
+    changed = session.info.setdefault("changed_user_subjects", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, models.User):
+            continue
+        state = inspect(obj)
+        if obj in session.deleted or any(state.attrs[name].history.has_changes() for name in WATCHED_ATTRIBUTES):
+            changed.add(obj.email)
+            changed.update(state.attrs.email.history.deleted or ())
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_users(session):
+    for subject in session.info.pop("changed_user_subjects", ()):
+        user_cache.invalidate(subject)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_users(session):
+    session.info.pop("changed_user_subjects", None)
+
+
+def touches_users(statement) -> bool:
+    table = getattr(statement, "table", None)
+    return isinstance(statement, (Update, Delete)) and getattr(table, "name", None) == models.User.__tablename__
+
+
+# Bulk query(...).update()/delete() and Core statements bypass the unit of
+# work, so there is no way to tell which users changed: the whole cache goes.
+@event.listens_for(Session, "do_orm_execute")
+def collect_bulk_user_changes(orm_execute_state):
+    if touches_users(orm_execute_state.statement):
+        orm_execute_state.session.info["users_bulk_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def clear_after_bulk_user_changes(session):
+    if session.info.pop("users_bulk_changed", False):
+        user_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_bulk_user_changes(session):
+    session.info.pop("users_bulk_changed", None)
+
+
+# Same for statements run on a plain Connection, outside any Session
+@event.listens_for(Engine, "after_execute")
+def collect_core_user_changes(conn, clauseelement, multiparams, params, execution_options, result):
+    if touches_users(clauseelement):
+        conn.info["users_bulk_changed"] = True
+
+
+@event.listens_for(Engine, "commit")
+def clear_after_core_user_changes(conn):
+    if conn.info.pop("users_bulk_changed", False):
+        user_cache.clear()
+
+
+@event.listens_for(Engine, "rollback")
+def discard_core_user_changes(conn):
+    conn.info.pop("users_bulk_changed", None)
@@ -3,28 +3,100 @@
 import { useState, useEffect } from 'react';
 import { Sidebar } from "@/components/Sidebar";
 import { AlertTriangle, ArrowUpRight, ArrowDownRight, RefreshCcw } from 'lucide-react';
+import api from '@/lib/api';
 
-interface InventoryItem {
+const MIN_STOCK = 5;
+
+interface ProductVariation {
+  id: number;
+  name: string;
+  stock: number;
+}
+
+interface Product {
   id: number;
+  sku?: string;
+  name: string;
+  stock: number;
+  variations: ProductVariation[];
+}
+
+interface InventoryItem {
+  key: string;
+  product_id: number;
+  variation_id?: number;
   name: string;
   sku: string;
   current_stock: number;
-  min_stock: number;
-  last_restock: string;
 }
 
 export default function InventoryPage() {
   const [items, setItems] = useState<InventoryItem[]>([]);
+  const [drafts, setDrafts] = useState<Record<string, string>>({});
+  const [loading, setLoading] = useState(true);
+
+  const fetchInventory = async () => {
+    try {
+      setLoading(true);
+      const response = await api.get('/products');
+      // Products with variations keep their stock per variation
+      const rows: InventoryItem[] = [];
+      response.data.forEach((product: Product) => {
+        if (product.variations && product.variations.length > 0) {
+          product.variations.forEach(variation => rows.push({
+            key: `v${variation.id}`,
+            product_id: product.id,
+            variation_id: variation.id,
+            name: `${product.name} - ${variation.name}`,
+            sku: product.sku || '-',
+            current_stock: variation.stock,
+          }));
+        } else {
+          rows.push({
+            key: `p${product.id}`,
+            product_id: product.id,
+            name: product.name,
+            sku: product.sku || '-',
+            current_stock: product.stock,
+          });
+        }
+      });
+      setItems(rows);
+      setDrafts({});
+    } catch (error) {
+      console.error("Error fetching inventory:", error);
+    } finally {
+      setLoading(false);
+    }
+  };
 
   useEffect(() => {
-    setItems([
-      { id: 1, name: 'Alimento Premium 10kg', sku: 'AL-PR-10', current_stock: 5, min_stock: 10, last_restock: '2025-01-15' },
-      { id: 2, name: 'Rascador Gato', sku: 'MU-RA-01', current_stock: 12, min_stock: 5, last_restock: '2025-01-10' },
-      { id: 3, name: 'Arena 5L', sku: 'HI-AR-05', current_stock: 3, min_stock: 20, last_restock: '2025-01-05' },
-      { id: 4, name: 'Juguete Ratón', sku: 'JU-RA-01', current_stock: 50, min_stock: 15, last_restock: '2025-01-20' },
-    ]);
+    fetchInventory();
   }, []);
 
+  const saveStock = async (item: InventoryItem) => {
+    const draft = drafts[item.key];
+    const stock = parseInt(draft, 10);
+    if (draft === undefined || isNaN(stock) || stock < 0 || stock === item.current_stock) {
+      setDrafts(prev => { const next = { ...prev }; delete next[item.key]; return next; });
+      return;
+    }
+    try {
+      // PATCH only sends the changed stock, so the backend updates a single row
+      const body = item.variation_id
+        ? { variations: [{ id: item.variation_id, stock }] }
+        : { stock };
+      await api.patch(`/products/${item.product_id}`, body);
+      setItems(prev => prev.map(i => i.key === item.key ? { ...i, current_stock: stock } : i));
+      setDrafts(prev => { const next = { ...prev }; delete next[item.key]; return next; });
+    } catch (error) {
+      console.error("Error updating stock:", error);
+      alert("Error al actualizar el stock.");
+    }
+  };
+
+  const lowStockCount = items.filter(item => item.current_stock <= MIN_STOCK).length;
+
   return (
     <>
       <div className="flex justify-between items-center mb-8">
@@ -32,7 +104,7 @@ export default function InventoryPage() {
           <h2 className="text-3xl font-bold text-gray-800">Inventario</h2>
           <p className="text-gray-600">Controla el stock y las reposiciones.</p>
         </div>
-        <button className="flex items-center gap-2 bg-gray-800 text-white px-4 py-2 rounded-lg hover:bg-gray-700 transition-colors">
+        <button onClick={fetchInventory} className="flex items-center gap-2 bg-gray-800 text-white px-4 py-2 rounded-lg hover:bg-gray-700 transition-colors">
           <RefreshCcw size={20} />
           <span>Actualizar Stock</span>
         </button>
@@ -42,7 +114,7 @@ export default function InventoryPage() {
         <div className="bg-white p-6 rounded-xl border border-red-100 shadow-sm">
           <p className="text-sm font-medium text-gray-500">Bajo Stock</p>
           <div className="flex items-end justify-between mt-2">
-            <p className="text-3xl font-bold text-red-600">8</p>
+            <p className="text-3xl font-bold text-red-600">{lowStockCount}</p>
             <AlertTriangle className="text-red-500 mb-1" size={24} />
           </div>
         </div>
@@ -71,24 +143,34 @@ export default function InventoryPage() {
               <th className="px-6 py-4 font-medium text-center">Stock Actual</th>
               <th className="px-6 py-4 font-medium text-center">Mínimo</th>
               <th className="px-6 py-4 font-medium text-center">Estado</th>
-              <th className="px-6 py-4 font-medium text-right">Última Reposición</th>
             </tr>
           </thead>
           <tbody className="divide-y divide-gray-100 text-sm">
-            {items.map((item) => {
-              const isLow = item.current_stock <= item.min_stock;
+            {loading ? (
+              <tr><td colSpan={5} className="px-6 py-8 text-center text-gray-500">Cargando inventario...</td></tr>
+            ) : items.map((item) => {
+              const isLow = item.current_stock <= MIN_STOCK;
               return (
-                <tr key={item.id} className="hover:bg-gray-50 transition-colors">
+                <tr key={item.key} className="hover:bg-gray-50 transition-colors">
                   <td className="px-6 py-4 font-medium text-gray-900">{item.name}</td>
                   <td className="px-6 py-4 text-center font-mono text-gray-500">{item.sku}</td>
-                  <td className="px-6 py-4 text-center font-bold">{item.current_stock}</td>
-                  <td className="px-6 py-4 text-center text-gray-500">{item.min_stock}</td>
+                  <td className="px-6 py-4 text-center">
+                    <input
+                      type="number"
+                      min={0}
+                      className="w-20 border rounded px-2 py-1 text-center font-bold"
+                      value={drafts[item.key] ?? item.current_stock}
+                      onChange={(e) => setDrafts({ ...drafts, [item.key]: e.target.value })}
+                      onBlur={() => saveStock(item)}
+                      onKeyDown={(e) => { if (e.key === 'Enter') (e.target as HTMLInputElement).blur(); }}
+                    />
+                  </td>
+                  <td className="px-6 py-4 text-center text-gray-500">{MIN_STOCK}</td>
                   <td className="px-6 py-4 text-center">
                     <span className={`px-2 py-1 rounded-full text-xs font-bold ${isLow ? 'bg-red-100 text-red-700' : 'bg-green-100 text-green-700'}`}>
                       {isLow ? 'REPONER' : 'OK'}
                     </span>
                   </td>
-                  <td className="px-6 py-4 text-right text-gray-500">{item.last_restock}</td>
                 </tr>
               );
             })}
@@ -22,35 +22,57 @@ export default function OrdersPage() {
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedOrder, setSelectedOrder] = useState<Order | null>(null);
   const [isUpdating, setIsUpdating] = useState(false);
+  const [statusFilter, setStatusFilter] = useState('');
+  const [dateFrom, setDateFrom] = useState('');
+  const [dateTo, setDateTo] = useState('');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [estimatedTotal, setEstimatedTotal] = useState<number | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  const exportCSV = () => {
-    const headers = ['ID', 'Cliente', 'Fecha', 'Estado', 'Pago', 'Total'];
-    const csvData = orders.map(o => [
-      o.id,
-      o.guest_email || 'Usuario',
-      new Date(o.created_at).toLocaleString(),
-      o.status,
-      o.payment_type,
-      o.total_amount
-    ]);
-    
-    const csvContent = [headers, ...csvData].map(e => e.join(",")).join("\n");
-    const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
-    const link = document.createElement("a");
-    const url = URL.createObjectURL(blob);
-    link.setAttribute("href", url);
-    link.setAttribute("download", `pedidos_miauhome_${new Date().toISOString().slice(0,10)}.csv`);
-    link.style.visibility = 'hidden';
-    document.body.appendChild(link);
-    link.click();
-    document.body.removeChild(link);
+  const orderFilterParams = () => {
+    const params: Record<string, string> = {};
+    if (statusFilter) params.status = statusFilter;
+    if (dateFrom) params.created_from = `${dateFrom}T00:00:00`;
+    if (dateTo) params.created_to = `${dateTo}T23:59:59`;
+    return params;
+  };
+
+  const exportCSV = async () => {
+    // Streamed by the server with the same filters as the table, not just the loaded page
+    try {
+      const response = await api.get('/export/orders', {
+        params: { ...orderFilterParams(), format: 'csv' },
+        responseType: 'blob'
+      });
+      const link = document.createElement("a");
+      const url = URL.createObjectURL(response.data);
+      link.setAttribute("href", url);
+      link.setAttribute("download", `pedidos_miauhome_${new Date().toISOString().slice(0,10)}.csv`);
+      link.style.visibility = 'hidden';
+      document.body.appendChild(link);
+      link.click();
+      document.body.removeChild(link);
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error("Error exporting orders:", error);
+      alert("Error al exportar los pedidos");
+    }
+  };
+
+  const fetchPage = async (after?: string) => {
+    const params = orderFilterParams();
+    if (after) params.after = after;
+    const response = await api.get('/orders', { params });
+    setNextCursor(response.headers['x-next-cursor'] || null);
+    const total = response.headers['x-estimated-total'];
+    setEstimatedTotal(total ? Number(total) : null);
+    return response.data as Order[];
   };
 
   const fetchOrders = async () => {
     try {
       setLoading(true);
-      const response = await api.get('/orders');
-      setOrders(response.data);
+      setOrders(await fetchPage());
     } catch (error) {
       console.error("Error fetching orders:", error);
     } finally {
@@ -58,6 +80,19 @@ export default function OrdersPage() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextCursor);
+      setOrders(prev => [...prev, ...page]);
+    } catch (error) {
+      console.error("Error fetching orders:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const updateOrderStatus = async (id: number, newStatus: string) => {
     try {
       setIsUpdating(true);
@@ -81,19 +116,8 @@ export default function OrdersPage() {
   );
 
   useEffect(() => {
-    const fetchOrders = async () => {
-      try {
-        setLoading(true);
-        const response = await api.get('/orders');
-        setOrders(response.data);
-      } catch (error) {
-        console.error("Error fetching orders:", error);
-      } finally {
-        setLoading(false);
-      }
-    };
     fetchOrders();
-  }, []);
+  }, [statusFilter, dateFrom, dateTo]);
 
   const getStatusColor = (status: string) => {
     switch (status) {
@@ -141,10 +165,31 @@ export default function OrdersPage() {
               className="w-full pl-10 pr-4 py-2 border rounded-lg focus:outline-none focus:ring-2 focus:ring-pink-500/20"
             />
           </div>
-          <button className="flex items-center gap-2 px-4 py-2 border rounded-lg hover:bg-gray-50 transition-colors">
-            <Filter size={18} />
-            <span>Filtros</span>
-          </button>
+          <div className="flex items-center gap-2 px-4 py-2 border rounded-lg">
+            <Filter size={18} className="text-gray-400" />
+            <select
+              value={statusFilter}
+              onChange={(e) => setStatusFilter(e.target.value)}
+              className="bg-transparent focus:outline-none"
+            >
+              <option value="">Todos los estados</option>
+              {['pending', 'paid', 'shipped', 'delivered', 'failed'].map((s) => (
+                <option key={s} value={s}>{getStatusText(s)}</option>
+              ))}
+            </select>
+          </div>
+          <input
+            type="date"
+            value={dateFrom}
+            onChange={(e) => setDateFrom(e.target.value)}
+            className="px-3 py-2 border rounded-lg text-sm text-gray-600"
+          />
+          <input
+            type="date"
+            value={dateTo}
+            onChange={(e) => setDateTo(e.target.value)}
+            className="px-3 py-2 border rounded-lg text-sm text-gray-600"
+          />
         </div>
 
         <div className="overflow-x-auto">
@@ -198,6 +243,24 @@ export default function OrdersPage() {
             </tbody>
           </table>
         </div>
+
+        {!loading && (
+          <div className="p-4 border-t flex justify-between items-center text-sm text-gray-500">
+            <span>
+              Mostrando {orders.length}
+              {estimatedTotal !== null && ` de ~${estimatedTotal.toLocaleString('es-CL')}`} pedidos
+            </span>
+            {nextCursor && (
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="px-4 py-2 border rounded-lg font-medium text-gray-700 hover:bg-gray-50 disabled:opacity-50 transition-colors"
+              >
+                {loadingMore ? 'Cargando...' : 'Cargar más'}
+              </button>
+            )}
+          </div>
+        )}
       </div>
 
       {/* Detail Modal */}
@@ -2,7 +2,7 @@
 
 import { useState, useEffect } from 'react';
 import { Sidebar } from "@/components/Sidebar";
-import { Plus, Search, Edit2, Trash2, Package, X, Save } from 'lucide-react';
+import { Plus, Search, Edit2, Trash2, Package, X, Save, Upload } from 'lucide-react';
 import api from '@/lib/api';
 
 interface ProductVariation {
@@ -36,6 +36,18 @@ export default function ProductsPage() {
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
   const [isModalOpen, setIsModalOpen] = useState(false);
+  const [editingProduct, setEditingProduct] = useState<Product | null>(null);
+  const [formData, setFormData] = useState<Product>({
+    name: '',
+    description: '',
+    price: 0,
+    image_url: '',
+    category: 'Muebles',
+    stock: 0,
+    is_active: true,
+    variations: [],
+    images: []
+  });
 
   const filteredProducts = products.filter(p => 
     p.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
@@ -135,6 +147,32 @@ export default function ProductsPage() {
     setFormData({ ...formData, variations: newVariations });
   };
 
+  const uploadImage = async (file: File): Promise<string | null> => {
+    // Stored by the API, which serves resized WebP/AVIF versions for the storefront
+    const body = new FormData();
+    body.append('file', file);
+    try {
+      const response = await api.post('/images', body);
+      return response.data.url;
+    } catch (error: any) {
+      console.error("Error uploading image:", error);
+      alert(error.response?.data?.detail || "Error al subir la imagen");
+      return null;
+    }
+  };
+
+  const uploadMainImage = async (file?: File) => {
+    if (!file) return;
+    const url = await uploadImage(file);
+    if (url) setFormData(prev => ({ ...prev, image_url: url }));
+  };
+
+  const uploadExtraImage = async (file?: File) => {
+    if (!file) return;
+    const url = await uploadImage(file);
+    if (url) setFormData(prev => ({ ...prev, images: [...prev.images, { url }] }));
+  };
+
   const addImage = () => {
     setFormData({
       ...formData,
@@ -343,25 +381,37 @@ export default function ProductsPage() {
                 </div>
                 <div className="space-y-1">
                   <label className="text-sm font-medium text-gray-700">URL Imagen Principal</label>
-                  <input 
-                    type="text" 
-                    value={formData.image_url}
-                    onChange={(e) => setFormData({...formData, image_url: e.target.value})}
-                    className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-pink-500/20 outline-none text-gray-700"
-                  />
+                  <div className="flex gap-2">
+                    <input 
+                      type="text" 
+                      value={formData.image_url}
+                      onChange={(e) => setFormData({...formData, image_url: e.target.value})}
+                      className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-pink-500/20 outline-none text-gray-700"
+                    />
+                    <label className="flex items-center px-3 border rounded-lg cursor-pointer text-gray-500 hover:text-pink-600" title="Subir imagen">
+                      <Upload size={18} />
+                      <input type="file" accept="image/*" className="hidden" onChange={(e) => uploadMainImage(e.target.files?.[0])} />
+                    </label>
+                  </div>
                 </div>
               </div>
 
               <div className="space-y-3 pt-4 border-t">
                 <div className="flex justify-between items-center">
                   <h4 className="font-bold text-gray-800">Imágenes Adicionales</h4>
-                  <button 
-                    type="button"
-                    onClick={addImage}
-                    className="text-sm flex items-center gap-1 text-pink-600 hover:text-pink-700 font-medium"
-                  >
-                    <Plus size={16} /> Añadir Imagen
-                  </button>
+                  <div className="flex gap-4">
+                    <label className="text-sm flex items-center gap-1 text-pink-600 hover:text-pink-700 font-medium cursor-pointer">
+                      <Upload size={16} /> Subir Imagen
+                      <input type="file" accept="image/*" className="hidden" onChange={(e) => uploadExtraImage(e.target.files?.[0])} />
+                    </label>
+                    <button 
+                      type="button"
+                      onClick={addImage}
+                      className="text-sm flex items-center gap-1 text-pink-600 hover:text-pink-700 font-medium"
+                    >
+                      <Plus size={16} /> Añadir Imagen
+                    </button>
+                  </div>
                 </div>
                 
                 {formData.images.length > 0 && (
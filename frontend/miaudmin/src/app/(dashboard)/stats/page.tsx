@@ -1,6 +1,8 @@
 "use client"
 
-import { Sidebar } from "@/components/Sidebar";
+import { useState, useEffect } from 'react';
+import { Loader2 } from 'lucide-react';
+import api from '@/lib/api';
 import { 
   LineChart, 
   Line, 
@@ -16,26 +18,63 @@ import {
   Cell
 } from 'recharts';
 
-const salesData = [
-  { name: 'Ene', sales: 4000 },
-  { name: 'Feb', sales: 3000 },
-  { name: 'Mar', sales: 5000 },
-  { name: 'Abr', sales: 2780 },
-  { name: 'May', sales: 1890 },
-  { name: 'Jun', sales: 2390 },
-  { name: 'Jul', sales: 3490 },
-];
+interface SalesPoint {
+  bucket: string;
+  order_count: number;
+  sales_total: number;
+}
 
-const categoryData = [
-  { name: 'Alimento', value: 400 },
-  { name: 'Juguetes', value: 300 },
-  { name: 'Higiene', value: 300 },
-  { name: 'Accesorios', value: 200 },
-];
+interface CategoryUnits {
+  category: string;
+  units: number;
+}
+
+interface SalesTimeseries {
+  period: string;
+  points: SalesPoint[];
+  categories: CategoryUnits[];
+}
 
 const COLORS = ['#f472b6', '#60a5fa', '#34d399', '#fbbf24'];
 
 export default function StatsPage() {
+  const [timeseries, setTimeseries] = useState<SalesTimeseries | null>(null);
+  const [loading, setLoading] = useState(true);
+
+  useEffect(() => {
+    const fetchTimeseries = async () => {
+      try {
+        setLoading(true);
+        const res = await api.get('/stats/timeseries', { params: { period: 'day' } });
+        setTimeseries(res.data);
+      } catch (error) {
+        console.error("Error fetching sales stats:", error);
+      } finally {
+        setLoading(false);
+      }
+    };
+    fetchTimeseries();
+  }, []);
+
+  const salesData = (timeseries?.points || []).map((point) => ({
+    name: new Date(point.bucket).toLocaleDateString('es-CL', { day: '2-digit', month: '2-digit' }),
+    sales: point.sales_total,
+    orders: point.order_count
+  }));
+  const categoryData = (timeseries?.categories || []).map((category) => ({
+    name: category.category || 'Sin categoría',
+    value: category.units
+  }));
+  const unitsSold = categoryData.reduce((sum, category) => sum + category.value, 0);
+
+  if (loading) {
+    return (
+      <div className="flex justify-center py-20">
+        <Loader2 className="h-12 w-12 animate-spin text-pink-500" />
+      </div>
+    );
+  }
+
   return (
     <>
       <header className="mb-8">
@@ -45,7 +84,7 @@ export default function StatsPage() {
 
       <div className="grid grid-cols-1 xl:grid-cols-2 gap-8 mb-8">
         <div className="bg-white p-6 rounded-xl shadow-sm border border-gray-100">
-          <h3 className="text-lg font-bold mb-6 text-gray-800">Ventas Mensuales</h3>
+          <h3 className="text-lg font-bold mb-6 text-gray-800">Ventas Diarias (últimos 30 días)</h3>
           <div className="h-80">
             <ResponsiveContainer width="100%" height="100%">
               <LineChart data={salesData}>
@@ -88,7 +127,7 @@ export default function StatsPage() {
               </PieChart>
             </ResponsiveContainer>
             <div className="absolute flex flex-col items-center">
-              <span className="text-2xl font-bold text-gray-800">1,200</span>
+              <span className="text-2xl font-bold text-gray-800">{unitsSold.toLocaleString('es-CL')}</span>
               <span className="text-sm text-gray-500 font-medium">Ventas</span>
             </div>
           </div>
@@ -96,7 +135,7 @@ export default function StatsPage() {
       </div>
 
       <div className="bg-white p-6 rounded-xl shadow-sm border border-gray-100">
-        <h3 className="text-lg font-bold mb-6 text-gray-800">Productos más Vendidos</h3>
+        <h3 className="text-lg font-bold mb-6 text-gray-800">Unidades Vendidas por Categoría</h3>
         <div className="h-80">
           <ResponsiveContainer width="100%" height="100%">
             <BarChart data={categoryData}>
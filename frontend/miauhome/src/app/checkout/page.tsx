@@ -1,6 +1,6 @@
 "use client";
 
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import { useCart } from '@/context/CartContext';
 import { useAuth } from '@/context/AuthContext';
@@ -22,6 +22,8 @@ export default function CheckoutPage() {
     const [guestEmail, setGuestEmail] = useState('');
     const [guestAddress, setGuestAddress] = useState('');
     const router = useRouter();
+    // One key per checkout attempt, so double clicks and retries reuse the same Webpay transaction
+    const idempotencyKey = useRef<string>(crypto.randomUUID());
     const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
     const handleCheckout = async () => {
@@ -35,9 +37,17 @@ export default function CheckoutPage() {
             const res = await axios.post(`${API_URL}/checkout`, {
                 total_amount: total,
                 guest_email: token ? null : guestEmail,
-                guest_address: token ? null : guestAddress
+                guest_address: token ? null : guestAddress,
+                items: cart.map(item => ({
+                    product_id: item.product.id,
+                    variation_id: item.variation?.id || null,
+                    quantity: item.quantity
+                }))
             }, {
-                headers: token ? { Authorization: `Bearer ${token}` } : {}
+                headers: {
+                    ...(token ? { Authorization: `Bearer ${token}` } : {}),
+                    'Idempotency-Key': idempotencyKey.current
+                }
             });
 
             if (res.data.url && res.data.token) {
@@ -57,7 +67,11 @@ export default function CheckoutPage() {
             }
         } catch (err) {
             console.error("Checkout error", err);
-            alert("Error al procesar el checkout");
+            if (axios.isAxiosError(err) && err.response?.status === 409) {
+                alert("Uno de los productos de tu carro ya no tiene stock suficiente.");
+            } else {
+                alert("Error al procesar el checkout");
+            }
         } finally {
             setIsProcessing(false);
         }
@@ -6,7 +6,7 @@ import { Button } from '@/components/ui/Button';
 
 async function getProducts() {
   try {
-    const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/products`, { 
+    const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/products?fields=card`, { 
       cache: 'no-store' 
     });
     if (!response.ok) return [];
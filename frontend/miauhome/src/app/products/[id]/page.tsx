@@ -7,6 +7,7 @@ import { Footer } from '@/components/Footer';
 import { Button } from '@/components/ui/Button';
 import { ShoppingCart, Star, ArrowLeft, ChevronRight, ChevronLeft } from 'lucide-react';
 import { useCart } from '@/context/CartContext';
+import { ProductImage } from '@/components/ProductImage';
 import Link from 'next/link';
 
 interface ProductVariation {
@@ -90,9 +91,11 @@ export default function ProductDetailPage() {
                         {/* Image Gallery */}
                         <div className="space-y-4">
                             <div className="relative aspect-square rounded-2xl overflow-hidden bg-gray-100 group">
-                                <img 
-                                    src={allImages[activeImage] || null} 
+                                <ProductImage
+                                    src={allImages[activeImage]}
                                     alt={product.name}
+                                    sizes="(min-width: 768px) 50vw, 100vw"
+                                    eager
                                     className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-105"
                                 />
                                 {allImages.length > 1 && (
@@ -119,7 +122,7 @@ export default function ProductDetailPage() {
                                         onClick={() => setActiveImage(i)}
                                         className={`relative w-20 h-20 flex-shrink-0 rounded-lg overflow-hidden border-2 transition-all ${activeImage === i ? 'border-primary' : 'border-transparent opacity-60 hover:opacity-100'}`}
                                     >
-                                        <img src={img} className="w-full h-full object-cover" alt="" />
+                                        <ProductImage src={img} alt="" sizes="80px" widths={[160]} className="w-full h-full object-cover" />
                                     </button>
                                 ))}
                             </div>
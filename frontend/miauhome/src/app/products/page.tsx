@@ -21,15 +21,29 @@ export default function CatalogPage() {
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedCategory, setSelectedCategory] = useState('Todas');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [searchResults, setSearchResults] = useState<Product[] | null>(null);
+  const [categoryFacets, setCategoryFacets] = useState<{ category: string; count: number }[]>([]);
 
   const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+  const PAGE_SIZE = 24;
+
+  const categoryParam = selectedCategory === 'Todas' ? undefined : selectedCategory;
+
+  const fetchPage = async (after?: string | null) => {
+    const res = await axios.get(`${API_URL}/products`, {
+      params: { limit: PAGE_SIZE, after: after || undefined, category: categoryParam, fields: 'card' }
+    });
+    setNextCursor(res.headers['x-next-cursor'] || null);
+    return res.data as Product[];
+  };
 
   useEffect(() => {
     const fetchProducts = async () => {
       try {
         setLoading(true);
-        const res = await axios.get(`${API_URL}/products`);
-        setProducts(res.data);
+        setProducts(await fetchPage());
       } catch (err) {
         console.error("Error fetching products", err);
       } finally {
@@ -37,14 +51,48 @@ export default function CatalogPage() {
       }
     };
     fetchProducts();
+  }, [selectedCategory]);
+
+  useEffect(() => {
+    axios.get(`${API_URL}/products/facets`)
+      .then(res => setCategoryFacets(res.data.categories))
+      .catch(err => console.error("Error fetching facets", err));
   }, []);
 
-  const categories = ['Todas', ...Array.from(new Set(products.map(p => p.category)))];
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextCursor);
+      setProducts(prev => [...prev, ...page]);
+    } catch (err) {
+      console.error("Error fetching products", err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
-  const filteredProducts = products.filter(p => {
-    const matchesSearch = p.name.toLowerCase().includes(searchTerm.toLowerCase());
-    const matchesCategory = selectedCategory === 'Todas' || p.category === selectedCategory;
-    return matchesSearch && matchesCategory;
+  useEffect(() => {
+    const term = searchTerm.trim();
+    if (!term) {
+      setSearchResults(null);
+      return;
+    }
+    const timeout = setTimeout(async () => {
+      try {
+        const res = await axios.get(`${API_URL}/products/search`, { params: { q: term, limit: 50, fields: 'card' } });
+        setSearchResults(res.data);
+      } catch (err) {
+        console.error("Error searching products", err);
+      }
+    }, 250);
+    return () => clearTimeout(timeout);
+  }, [searchTerm]);
+
+  const categories = ['Todas', ...categoryFacets.map(f => f.category)];
+
+  const filteredProducts = (searchResults ?? products).filter(p => {
+    return selectedCategory === 'Todas' || p.category === selectedCategory;
   });
 
   return (
@@ -128,6 +176,18 @@ export default function CatalogPage() {
                 ))}
               </div>
             )}
+
+            {!loading && nextCursor && !searchResults && (
+              <div className="flex justify-center mt-10">
+                <button
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="px-6 py-3 rounded-xl bg-white border border-gray-200 text-sm font-bold text-gray-700 hover:bg-gray-100 disabled:opacity-50"
+                >
+                  {loadingMore ? 'Cargando...' : 'Cargar más'}
+                </button>
+              </div>
+            )}
           </div>
         </div>
       </main>
@@ -17,14 +17,22 @@ export default function OrdersPage() {
     const { token } = useAuth();
     const [orders, setOrders] = useState<Order[]>([]);
     const [isLoading, setIsLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+
+    const fetchPage = async (after?: string) => {
+        const res = await axios.get('http://localhost:8000/users/me/orders', {
+            headers: { Authorization: `Bearer ${token}` },
+            params: after ? { after } : {}
+        });
+        setNextCursor(res.headers['x-next-cursor'] || null);
+        return res.data as Order[];
+    };
 
     useEffect(() => {
         const fetchOrders = async () => {
             try {
-                const res = await axios.get('http://localhost:8000/users/me/orders', {
-                    headers: { Authorization: `Bearer ${token}` }
-                });
-                setOrders(res.data);
+                setOrders(await fetchPage());
             } catch (err) {
                 console.error("Error fetching orders", err);
             } finally {
@@ -35,6 +43,19 @@ export default function OrdersPage() {
         if (token) fetchOrders();
     }, [token]);
 
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        try {
+            setLoadingMore(true);
+            const page = await fetchPage(nextCursor);
+            setOrders(prev => [...prev, ...page]);
+        } catch (err) {
+            console.error("Error fetching orders", err);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const getStatusColor = (status: string) => {
         switch (status.toLowerCase()) {
             case 'paid': return 'bg-green-100 text-green-700 border-green-200';
@@ -111,6 +132,17 @@ export default function OrdersPage() {
                             </div>
                         </div>
                     ))}
+                    {nextCursor && (
+                        <div className="flex justify-center pt-4">
+                            <button
+                                onClick={loadMore}
+                                disabled={loadingMore}
+                                className="px-6 py-3 rounded-xl bg-white border border-gray-200 text-sm font-bold text-gray-700 hover:bg-gray-100 disabled:opacity-50"
+                            >
+                                {loadingMore ? 'Cargando...' : 'Cargar más'}
+                            </button>
+                        </div>
+                    )}
                 </div>
             )}
         </div>
@@ -4,6 +4,7 @@ import Link from 'next/link';
 import { ShoppingCart, Star } from 'lucide-react';
 import { Button } from '@/components/ui/Button';
 import { useCart } from '@/context/CartContext';
+import { ProductImage } from '@/components/ProductImage';
 
 interface ProductVariation {
   id: number;
@@ -15,7 +16,7 @@ interface ProductVariation {
 interface Product {
   id: number;
   name: string;
-  description: string;
+  description?: string;
   price: number;
   image_url: string;
   category: string;
@@ -39,9 +40,10 @@ export function ProductCard({ product }: ProductCardProps) {
   return (
     <Link href={`/products/${product.id}`} className="group relative flex flex-col overflow-hidden rounded-2xl border bg-white shadow-sm transition-all hover:shadow-lg">
       <div className="relative aspect-square overflow-hidden bg-gray-100">
-        <img
-          src={product.image_url || "/placeholder.png"}
+        <ProductImage
+          src={product.image_url}
           alt={product.name}
+          sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
           className="object-cover w-full h-full transition-transform duration-300 group-hover:scale-105"
         />
         <div className="absolute top-3 right-3 rounded-full bg-white/90 px-2 py-1 text-xs font-semibold shadow-sm backdrop-blur-sm">
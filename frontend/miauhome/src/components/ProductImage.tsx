@@ -0,0 +1,34 @@
+import { AVIF_ENABLED, IMAGE_WIDTHS, imageSrcSet, imageVariant, isLocalImage } from '@/lib/images';
+
+interface ProductImageProps {
+  src?: string | null;
+  alt: string;
+  className?: string;
+  // How wide the image is drawn, so the browser can pick the smallest variant
+  sizes?: string;
+  widths?: number[];
+  eager?: boolean;
+}
+
+export function ProductImage({ src, alt, className, sizes = '100vw', widths = IMAGE_WIDTHS, eager = false }: ProductImageProps) {
+  const loading = eager ? 'eager' : 'lazy';
+  if (!src || !isLocalImage(src)) {
+    return <img src={src || "/placeholder.png"} alt={alt} className={className} loading={loading} decoding="async" />;
+  }
+  const fallbackWidth = widths.find(width => width >= 640) || widths[widths.length - 1];
+  return (
+    <picture>
+      {AVIF_ENABLED && <source type="image/avif" srcSet={imageSrcSet(src, 'avif', widths)} sizes={sizes} />}
+      <source type="image/webp" srcSet={imageSrcSet(src, 'webp', widths)} sizes={sizes} />
+      <img
+        src={imageVariant(src, fallbackWidth, 'jpg')}
+        srcSet={imageSrcSet(src, 'jpg', widths)}
+        sizes={sizes}
+        alt={alt}
+        className={className}
+        loading={loading}
+        decoding="async"
+      />
+    </picture>
+  );
+}
@@ -1,6 +1,6 @@
 "use client";
 
-import React, { createContext, useContext, useState, useEffect, ReactNode } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef, ReactNode } from 'react';
 import axios from 'axios';
 import { useAuth } from './AuthContext';
 
@@ -41,6 +41,7 @@ const CartContext = createContext<CartContextType | undefined>(undefined);
 
 export const CartProvider = ({ children }: { children: ReactNode }) => {
     const [cart, setCart] = useState<CartItem[]>([]);
+    const cartEtag = useRef<string | null>(null);
     const { token } = useAuth();
 
     const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
@@ -58,14 +59,43 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
         }
     }, [token]);
 
+    const applyCart = (res: { data: { items?: CartItem[] }, headers: Record<string, any> }) => {
+        cartEtag.current = res.headers['etag'] || null;
+        if (res.data && res.data.items) {
+            setCart(res.data.items);
+        }
+    };
+
     const loadCart = async (authToken: string) => {
         try {
+            // Items added while logged out are merged in a single request
+            const savedCart = typeof window !== 'undefined' ? localStorage.getItem('guest_cart') : null;
+            if (savedCart) {
+                const guestItems: CartItem[] = JSON.parse(savedCart);
+                const res = await axios.put(`${API_URL}/cart`, {
+                    add: guestItems.map(item => ({
+                        product_id: item.product.id,
+                        variation_id: item.variation?.id || null,
+                        quantity: item.quantity
+                    }))
+                }, {
+                    headers: { Authorization: `Bearer ${authToken}` }
+                });
+                localStorage.removeItem('guest_cart');
+                applyCart(res);
+                return;
+            }
+
+            const headers: Record<string, string> = { Authorization: `Bearer ${authToken}` };
+            if (cartEtag.current) {
+                headers['If-None-Match'] = cartEtag.current;
+            }
             const res = await axios.get(`${API_URL}/cart`, {
-                headers: { Authorization: `Bearer ${authToken}` }
+                headers,
+                validateStatus: status => (status >= 200 && status < 300) || status === 304
             });
-            const backendCart = res.data;
-            if (backendCart && backendCart.items) {
-                setCart(backendCart.items);
+            if (res.status !== 304) {
+                applyCart(res);
             }
         } catch (error) {
             console.error("Error loading cart", error);
@@ -75,14 +105,16 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
     const addToCart = async (product: Product, variation?: ProductVariation, quantity: number = 1) => {
         if (token) {
             try {
-                const res = await axios.post(`${API_URL}/cart/items`, {
-                    product_id: product.id,
-                    variation_id: variation?.id || null,
-                    quantity: quantity
+                const res = await axios.put(`${API_URL}/cart`, {
+                    add: [{
+                        product_id: product.id,
+                        variation_id: variation?.id || null,
+                        quantity: quantity
+                    }]
                 }, {
                     headers: { Authorization: `Bearer ${token}` }
                 });
-                setCart(res.data.items);
+                applyCart(res);
             } catch (error) {
                 console.error("Error syncing cart", error);
                 alert("Error al añadir al carro.");
@@ -116,7 +148,7 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
                 const res = await axios.delete(`${API_URL}/cart/items/${productId}`, {
                     headers: { Authorization: `Bearer ${token}` }
                 });
-                setCart(res.data.items);
+                applyCart(res);
             } catch (error) {
                 console.error("Error removing item", error);
             }
@@ -129,6 +161,7 @@ export const CartProvider = ({ children }: { children: ReactNode }) => {
 
     const clearCart = () => {
         setCart([]);
+        cartEtag.current = null;
         localStorage.removeItem('guest_cart');
     };
 
@@ -0,0 +1,24 @@
+// Images uploaded through the API live at /images/<hash>.<ext> and have
+// resized AVIF/WebP/JPEG variants at /images/<hash>/<width>.<format>.
+// Remote URLs (e.g. Unsplash) are used as they are.
+const LOCAL_IMAGE = /^(.*\/images\/[0-9a-f]{32})\.\w+$/;
+
+export const IMAGE_WIDTHS = [160, 320, 640, 1024, 1600];
+
+// The API only renders AVIF when its Pillow has an AVIF encoder. Browsers
+// don't fall back to the next <source> when a variant fails, so builds
+// against an API without it must set NEXT_PUBLIC_IMAGE_AVIF=0.
+export const AVIF_ENABLED = process.env.NEXT_PUBLIC_IMAGE_AVIF !== '0';
+
+export function isLocalImage(url?: string | null) {
+  return !!url && LOCAL_IMAGE.test(url);
+}
+
+export function imageVariant(url: string, width: number, format: 'avif' | 'webp' | 'jpg' = 'jpg') {
+  const match = url.match(LOCAL_IMAGE);
+  return match ? `${match[1]}/${width}.${format}` : url;
+}
+
+export function imageSrcSet(url: string, format: 'avif' | 'webp' | 'jpg', widths: number[] = IMAGE_WIDTHS) {
+  return widths.map(width => `${imageVariant(url, width, format)} ${width}w`).join(', ');
+}